@@ -1,59 +1,9 @@
 import subprocess
 import os
-import sys
-from pathlib import Path
 from datetime import datetime, timedelta
 from multiprocessing import Pool
 
-DEFAULT_ENV_PATH = Path(__file__).resolve().parent.parent.parent / '.env'
-
-
-# Load environment variables from .env file
-def load_env_file(env_path=None):
-    """
-    Load environment variables from a dotenv-style file into os.environ.
-    
-    Reads the file at env_path (default repo-level '.env'), ignoring empty lines
-    and lines starting with '#'. Each non-comment line containing '=' is split
-    on the first '=' and the left/right parts are stripped and set as KEY=VALUE
-    in os.environ.
-    
-    If the file does not exist, prints an error message and exits the process with
-    status code 1.
-    """
-    env_file = DEFAULT_ENV_PATH if env_path is None else Path(env_path).expanduser()
-    if env_file.exists():
-        with open(env_file, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#') and '=' in line:
-                    key, value = line.split('=', 1)
-                    os.environ[key.strip()] = value.strip()
-    else:
-        print(f"ERROR: Environment file '{env_file}' not found!")
-        print("Please copy .env.example to .env and configure your settings.")
-        sys.exit(1)
-
-# Load environment variables
-load_env_file()
-
-# Get required environment variables with error handling
-def get_required_env(key):
-    """Get required environment variable or exit with error"""
-    value = os.environ.get(key)
-    if not value:
-        print(f"ERROR: Required environment variable '{key}' is not set!")
-        print("Please check your .env file configuration.")
-        sys.exit(1)
-    return value
-
-# Configuration from environment variables
-NETFLOW_DATA_PATH = get_required_env('NETFLOW_DATA_PATH')
-AVAILABLE_ROUTERS = get_required_env('AVAILABLE_ROUTERS').split(',')
-DATABASE_PATH = get_required_env('DATABASE_PATH')
-FIRST_RUN = os.environ.get('FIRST_RUN', 'False').lower() in ('true', '1', 'yes')
-MAX_WORKERS = int(os.environ.get('MAX_WORKERS', '8'))
-BATCH_SIZE = int(os.environ.get('BATCH_SIZE', '50'))
+from common import NETFLOW_DATA_PATH, MAX_WORKERS
 
 
 def process_file(file_path):
@@ -19,7 +19,7 @@ import subprocess
 from datetime import datetime
 from pathlib import Path
 
-from common import DATABASE_PATH, init_processed_files_table
+from common import DATABASE_PATH, configure_connection, init_processed_files_table
 
 # Migration timestamps
 KNOWN_GOOD_START = 1738368000  # Feb 1, 2025 (matches DATA_START_DATE in common.py)
@@ -275,6 +275,7 @@ def main():
     print(f"Delete after: {DELETE_AFTER}")
     
     conn = sqlite3.connect(DATABASE_PATH)
+    configure_connection(conn, readonly=args.verify_only or args.dry_run)
     
     try:
         if args.verify_only:
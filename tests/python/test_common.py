@@ -1,5 +1,7 @@
 import importlib
 import json
+import os
+import sqlite3
 from datetime import datetime
 from pathlib import Path
 
@@ -117,3 +119,129 @@ def test_get_dataset_start_date_rejects_bad_format(monkeypatch: pytest.MonkeyPat
 
     with pytest.raises(common.ConfigurationError, match='Expected YYYY-MM-DD'):
         common.get_dataset_start_date()
+
+
+def test_get_db_connection_applies_performance_pragmas(tmp_path: Path) -> None:
+    common = load_common()
+    db_path = tmp_path / 'netflow.sqlite'
+
+    with common.get_db_connection(db_path=db_path) as conn:
+        assert conn.execute('PRAGMA journal_mode').fetchone() == ('wal',)
+        assert conn.execute('PRAGMA synchronous').fetchone() == (1,)
+        assert conn.execute('PRAGMA temp_store').fetchone() == (2,)
+        assert conn.execute('PRAGMA cache_size').fetchone() == (-65536,)
+
+    with common.get_db_connection(db_path=db_path, readonly=True) as conn:
+        assert conn.execute('PRAGMA synchronous').fetchone() == (2,)
+
+    fresh_path = tmp_path / 'fresh.sqlite'
+    with common.get_db_connection(db_path=fresh_path, readonly=True) as conn:
+        assert conn.execute('PRAGMA journal_mode').fetchone() == ('delete',)
+
+
+def test_get_db_connection_closes_when_body_or_optimize_fails(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    common = load_common()
+    connect = sqlite3.connect
+
+    class FailingOptimizeConnection(sqlite3.Connection):
+        def execute(self, sql, *args):
+            if sql.startswith('PRAGMA optimize'):
+                raise sqlite3.OperationalError('database is locked')
+            return super().execute(sql, *args)
+
+    monkeypatch.setattr(
+        common.sqlite3,
+        'connect',
+        lambda *args, **kwargs: connect(*args, factory=FailingOptimizeConnection, **kwargs),
+    )
+
+    with pytest.raises(ValueError, match='body failed'):
+        with common.get_db_connection(db_path=tmp_path / 'a.sqlite') as failed_conn:
+            raise ValueError('body failed')
+
+    with common.get_db_connection(db_path=tmp_path / 'b.sqlite') as optimized_conn:
+        optimized_conn.execute('CREATE TABLE t (x INTEGER)')
+
+    for conn in (failed_conn, optimized_conn):
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute('SELECT 1')
+
+
+def write_fake_nfdump(bin_dir: Path, script: str) -> None:
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    nfdump = bin_dir / 'nfdump'
+    nfdump.write_text('#!/bin/sh\n' + script)
+    nfdump.chmod(0o755)
+
+
+def test_iter_nfdump_lines_streams_stdout(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    common = load_common()
+    write_fake_nfdump(tmp_path / 'bin', 'printf "a,b\\nc,d\\n"\n')
+    monkeypatch.setenv('PATH', f"{tmp_path / 'bin'}:{os.environ['PATH']}")
+
+    assert list(common.iter_nfdump_lines(['-r', 'x'])) == ['a,b\n', 'c,d\n']
+
+
+def test_iter_nfdump_lines_raises_on_failure(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    common = load_common()
+    write_fake_nfdump(tmp_path / 'bin', 'echo broken >&2\nexit 3\n')
+    monkeypatch.setenv('PATH', f"{tmp_path / 'bin'}:{os.environ['PATH']}")
+
+    with pytest.raises(common.subprocess.CalledProcessError) as excinfo:
+        list(common.iter_nfdump_lines(['-r', 'x']))
+
+    assert excinfo.value.stderr == 'broken\n'
+
+
+def test_iter_nfdump_lines_does_not_block_on_large_stderr(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    common = load_common()
+    # Far more warnings than a pipe buffer holds, written before any stdout
+    write_fake_nfdump(
+        tmp_path / 'bin',
+        'i=0\nwhile [ $i -lt 5000 ]; do echo "skip corrupt block $i" >&2; i=$((i+1)); done\n'
+        'printf "a,b\\n"\n',
+    )
+    monkeypatch.setenv('PATH', f"{tmp_path / 'bin'}:{os.environ['PATH']}")
+
+    assert list(common.iter_nfdump_lines(['-r', 'x'], timeout=10)) == ['a,b\n']
+
+
+def test_parse_file_path_extracts_router_and_timestamp() -> None:
+    common = load_common()
+
+    assert common.parse_file_path('/captures/r1/2025/03/01/nfcapd.202503010005') == (
+        'r1',
+        datetime(2025, 3, 1, 0, 5),
+    )
+    with pytest.raises(ValueError, match='Invalid timestamp format'):
+        common.parse_file_path('/captures/r1/2025/03/01/nfcapd.invalid')
+    with pytest.raises(ValueError, match='Cannot extract router'):
+        common.parse_file_path('2025/03/01/nfcapd.202503010005')
+
+
+def test_construct_file_path_round_trips_with_parse_file_path(monkeypatch: pytest.MonkeyPatch) -> None:
+    common = load_common()
+    monkeypatch.setattr(common, 'NETFLOW_DATA_PATH', '/captures')
+
+    path = common.construct_file_path('r1', datetime(2025, 3, 1, 9, 5))
+
+    assert path == '/captures/r1/2025/03/01/nfcapd.202503010905'
+    assert common.parse_file_path(path) == ('r1', datetime(2025, 3, 1, 9, 5))
+
+
+def test_load_env_file_skips_comments_and_blank_lines(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    common = load_common()
+    env_path = tmp_path / '.env'
+    env_path.write_text('# comment\n\n  ENV_TEST_A = one \n#ENV_TEST_B=two\nENV_TEST_C=x=y\nnot a pair\n')
+    for key in ('ENV_TEST_A', 'ENV_TEST_B', 'ENV_TEST_C'):
+        monkeypatch.delenv(key, raising=False)
+
+    common.load_env_file(str(env_path))
+
+    assert os.environ['ENV_TEST_A'] == 'one'
+    assert 'ENV_TEST_B' not in os.environ
+    assert os.environ['ENV_TEST_C'] == 'x=y'
@@ -27,26 +27,6 @@ def test_get_discovery_start_dt_respects_window(monkeypatch: pytest.MonkeyPatch)
     assert discovery.get_discovery_start_dt(3) == datetime(2025, 3, 17)
 
 
-def test_identify_gaps_returns_missing_intervals() -> None:
-    common, discovery = load_modules()
-    conn = sqlite3.connect(':memory:')
-    common.init_processed_files_table(conn)
-
-    start = datetime(2025, 3, 1, 0, 0)
-    rows = [
-        ('a', 'r1', common.timestamp_to_unix(start), 1),
-        ('b', 'r1', common.timestamp_to_unix(datetime(2025, 3, 1, 0, 10)), 1),
-    ]
-    conn.executemany(
-        'INSERT INTO processed_files (file_path, router, timestamp, file_exists) VALUES (?, ?, ?, ?)',
-        rows,
-    )
-
-    gaps = discovery.identify_gaps(conn, 'r1', start, datetime(2025, 3, 1, 0, 15))
-
-    assert gaps == [datetime(2025, 3, 1, 0, 5)]
-
-
 def test_sync_processed_files_table_inserts_discoveries_and_gaps(
     monkeypatch: pytest.MonkeyPatch,
 ) -> None:
@@ -59,18 +39,14 @@ def test_sync_processed_files_table_inserts_discoveries_and_gaps(
     monkeypatch.setattr(
         discovery,
         'scan_filesystem',
-        lambda discovery_window_days=0: iter(
+        lambda discovery_window_days=0, *scan_cache: iter(
             [
-                ('/captures/r1/2025/03/01/nfcapd.202503010000', 'r1', datetime(2025, 3, 1, 0, 0)),
-                ('/captures/r1/2025/03/01/nfcapd.202503010010', 'r1', datetime(2025, 3, 1, 0, 10)),
+                ('/captures/r1/2025/03/01/nfcapd.202503010000', 'r1', common.timestamp_to_unix(datetime(2025, 3, 1, 0, 0))),
+                ('/captures/r1/2025/03/01/nfcapd.202503010010', 'r1', common.timestamp_to_unix(datetime(2025, 3, 1, 0, 10))),
             ]
         ),
     )
-    monkeypatch.setattr(
-        discovery,
-        'construct_file_path',
-        lambda router, timestamp: f"/captures/{router}/{timestamp.strftime('%Y/%m/%d')}/nfcapd.{timestamp.strftime('%Y%m%d%H%M')}",
-    )
+    monkeypatch.setattr(discovery, 'NETFLOW_DATA_PATH', '/captures')
 
     stats = discovery.sync_processed_files_table(
         conn,
@@ -113,6 +89,72 @@ def test_scan_filesystem_skips_unparseable_and_pre_start_files(
     assert rows == []
 
 
+def test_scan_filesystem_lists_day_directories_and_skips_missing_days(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    common, discovery = load_modules()
+    root = tmp_path / 'captures' / 'r1' / '2025' / '03' / '01'
+    root.mkdir(parents=True)
+    (root / 'nfcapd.202503010005').write_text('')
+    (root / 'nfcapd.202503010000').write_text('')
+    (root / 'README').write_text('')
+    (tmp_path / 'captures' / 'r1' / 'lost+found').mkdir()
+    (tmp_path / 'captures' / 'r1' / '2025' / '02' / '28').mkdir(parents=True)
+
+    monkeypatch.setattr(discovery, 'NETFLOW_DATA_PATH', str(tmp_path / 'captures'))
+    monkeypatch.setattr(discovery, 'AVAILABLE_ROUTERS', ['r1'])
+    monkeypatch.setattr(discovery, 'DATA_START_DATE', datetime(2025, 3, 1))
+    monkeypatch.setattr(
+        discovery,
+        'iter_scan_days',
+        lambda discovery_window_days=0: iter([datetime(2025, 3, 1), datetime(2025, 3, 2)]),
+    )
+
+    rows = list(discovery.scan_filesystem())
+
+    assert rows == [
+        (str(root / 'nfcapd.202503010000'), 'r1', common.timestamp_to_unix(datetime(2025, 3, 1, 0, 0))),
+        (str(root / 'nfcapd.202503010005'), 'r1', common.timestamp_to_unix(datetime(2025, 3, 1, 0, 5))),
+    ]
+
+
+def test_scan_filesystem_walks_routers_in_parallel_and_keeps_per_router_order(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    common, discovery = load_modules()
+    expected = {}
+    for router in ('r1', 'r2'):
+        day_dir = tmp_path / 'captures' / router / '2025' / '03' / '01'
+        day_dir.mkdir(parents=True)
+        for minute in (0, 5, 10):
+            (day_dir / f'nfcapd.2025030100{minute:02d}').write_text('')
+        expected[router] = [
+            (
+                str(day_dir / f'nfcapd.2025030100{minute:02d}'),
+                router,
+                common.timestamp_to_unix(datetime(2025, 3, 1, 0, minute)),
+            )
+            for minute in (0, 5, 10)
+        ]
+
+    monkeypatch.setattr(discovery, 'NETFLOW_DATA_PATH', str(tmp_path / 'captures'))
+    monkeypatch.setattr(discovery, 'AVAILABLE_ROUTERS', ['r1', 'r2', 'missing'])
+    monkeypatch.setattr(discovery, 'DATA_START_DATE', datetime(2025, 3, 1))
+    monkeypatch.setattr(discovery, 'SCAN_PAGE_SIZE', 1)
+    monkeypatch.setattr(discovery, 'SCAN_QUEUE_PAGES', 1)
+    monkeypatch.setattr(
+        discovery,
+        'iter_scan_days',
+        lambda discovery_window_days=0: iter([datetime(2025, 3, 1)]),
+    )
+
+    rows = list(discovery.scan_filesystem())
+
+    assert [row for row in rows if row[1] == 'r1'] == expected['r1']
+    assert [row for row in rows if row[1] == 'r2'] == expected['r2']
+    assert len(rows) == 6
+
+
 def test_get_stale_days_uses_local_day_boundaries() -> None:
     common, discovery = load_modules()
     conn = sqlite3.connect(':memory:')
@@ -160,8 +202,8 @@ def test_sync_processed_files_table_updates_mirrored_path_without_duplication(
     monkeypatch.setattr(
         discovery,
         'scan_filesystem',
-        lambda discovery_window_days=0: iter(
-            [('/new-root/r1/2025/03/02/nfcapd.202503020000', 'r1', datetime(2025, 3, 2, 0, 0))]
+        lambda discovery_window_days=0, *scan_cache: iter(
+            [('/new-root/r1/2025/03/02/nfcapd.202503020000', 'r1', ts)]
         ),
     )
 
@@ -177,3 +219,300 @@ def test_sync_processed_files_table_updates_mirrored_path_without_duplication(
     ).fetchone()
     assert stats == {'discovered': 1, 'new_files': 0, 'gaps': 0}
     assert row == ('/new-root/r1/2025/03/02/nfcapd.202503020000', 'r1', ts, 1)
+
+
+def test_sync_processed_files_table_batches_new_files_and_skips_known_paths(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    common, discovery = load_modules()
+    conn = sqlite3.connect(':memory:')
+    common.init_processed_files_table(conn)
+
+    gap_ts = common.timestamp_to_unix(datetime(2025, 3, 2, 0, 0))
+    conn.execute(
+        'INSERT INTO processed_files (file_path, router, timestamp, file_exists, ip_stats_status) '
+        'VALUES (?, ?, ?, 0, ?)',
+        ('/captures/r1/2025/03/02/nfcapd.202503020000', 'r1', gap_ts, 'success'),
+    )
+    conn.execute(
+        'INSERT INTO processed_files (file_path, router, timestamp, file_exists, ip_stats_status) '
+        'VALUES (?, ?, ?, 1, ?)',
+        ('/captures/r1/2025/03/02/nfcapd.202503020010', 'r1', gap_ts + 600, 'success'),
+    )
+    conn.commit()
+
+    monkeypatch.setattr(discovery, 'SYNC_BATCH_SIZE', 1)
+    monkeypatch.setattr(
+        discovery,
+        'scan_filesystem',
+        lambda discovery_window_days=0, *scan_cache: iter(
+            [
+                ('/captures/r1/2025/03/02/nfcapd.202503020000', 'r1', common.timestamp_to_unix(datetime(2025, 3, 2, 0, 0))),
+                ('/captures/r1/2025/03/02/nfcapd.202503020005', 'r1', common.timestamp_to_unix(datetime(2025, 3, 2, 0, 5))),
+                ('/captures/r1/2025/03/02/nfcapd.202503020010', 'r1', common.timestamp_to_unix(datetime(2025, 3, 2, 0, 10))),
+            ]
+        ),
+    )
+
+    stats = discovery.sync_processed_files_table(conn, include_gaps=False)
+
+    rows = conn.execute(
+        'SELECT timestamp, file_exists, ip_stats_status FROM processed_files ORDER BY timestamp'
+    ).fetchall()
+    assert stats == {'discovered': 3, 'new_files': 1, 'gaps': 0}
+    assert rows == [(gap_ts, 1, None), (gap_ts + 300, 1, None), (gap_ts + 600, 1, 'success')]
+
+
+def test_sync_processed_files_table_skips_day_dirs_unchanged_since_last_scan(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    common, discovery = load_modules()
+    conn = sqlite3.connect(':memory:')
+    common.init_processed_files_table(conn)
+
+    day_dir = tmp_path / 'captures' / 'r1' / '2025' / '03' / '01'
+    day_dir.mkdir(parents=True)
+    (day_dir / 'nfcapd.202503010000').write_text('')
+
+    monkeypatch.setattr(discovery, 'NETFLOW_DATA_PATH', str(tmp_path / 'captures'))
+    monkeypatch.setattr(discovery, 'AVAILABLE_ROUTERS', ['r1'])
+    monkeypatch.setattr(discovery, 'DATA_START_DATE', datetime(2025, 3, 1))
+    monkeypatch.setattr(
+        discovery,
+        'iter_scan_days',
+        lambda discovery_window_days=0: iter([datetime(2025, 3, 1)]),
+    )
+
+    first = discovery.sync_processed_files_table(conn, include_gaps=False)
+    second = discovery.sync_processed_files_table(conn, include_gaps=False)
+
+    (day_dir / 'nfcapd.202503010005').write_text('')
+    third = discovery.sync_processed_files_table(conn, include_gaps=False)
+
+    assert first == {'discovered': 1, 'new_files': 1, 'gaps': 0}
+    assert second == {'discovered': 0, 'new_files': 0, 'gaps': 0}
+    assert third == {'discovered': 2, 'new_files': 1, 'gaps': 0}
+    assert conn.execute('SELECT dir_path FROM scan_cache').fetchall() == [(str(day_dir),)]
+
+
+def test_sync_processed_files_table_rescans_cached_day_dirs_with_missing_rows(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    common, discovery = load_modules()
+    conn = sqlite3.connect(':memory:')
+    common.init_processed_files_table(conn)
+
+    day_dir = tmp_path / 'captures' / 'r1' / '2025' / '03' / '01'
+    day_dir.mkdir(parents=True)
+    (day_dir / 'nfcapd.202503010000').write_text('')
+    (day_dir / 'nfcapd.202503010005').write_text('')
+
+    monkeypatch.setattr(discovery, 'NETFLOW_DATA_PATH', str(tmp_path / 'captures'))
+    monkeypatch.setattr(discovery, 'AVAILABLE_ROUTERS', ['r1'])
+    monkeypatch.setattr(discovery, 'DATA_START_DATE', datetime(2025, 3, 1))
+    monkeypatch.setattr(
+        discovery,
+        'iter_scan_days',
+        lambda discovery_window_days=0: iter([datetime(2025, 3, 1)]),
+    )
+
+    discovery.sync_processed_files_table(conn, include_gaps=False)
+    conn.execute('DELETE FROM processed_files WHERE file_path LIKE ?', ('%0005',))
+    conn.execute(
+        "INSERT INTO scan_cache (dir_path, mtime_ns, file_count) VALUES ('/gone/r1/2024/01/01', 1, 1)"
+    )
+    conn.commit()
+
+    partial = discovery.sync_processed_files_table(conn, include_gaps=False)
+    conn.execute('DELETE FROM processed_files')
+    conn.commit()
+    emptied = discovery.sync_processed_files_table(conn, include_gaps=False)
+
+    assert partial == {'discovered': 2, 'new_files': 1, 'gaps': 0}
+    assert emptied == {'discovered': 2, 'new_files': 2, 'gaps': 0}
+    assert conn.execute('SELECT COUNT(*) FROM processed_files').fetchone() == (2,)
+    assert conn.execute('SELECT dir_path, file_count FROM scan_cache').fetchall() == [
+        (str(day_dir), 2)
+    ]
+
+
+def test_get_files_needing_processing_streams_complete_days_up_to_limit() -> None:
+    common, discovery = load_modules()
+    conn = sqlite3.connect(':memory:')
+    common.init_processed_files_table(conn)
+
+    day1 = common.timestamp_to_unix(datetime(2025, 3, 1, 0, 0))
+    day2 = common.timestamp_to_unix(datetime(2025, 3, 2, 0, 0))
+    conn.executemany(
+        'INSERT INTO processed_files (file_path, router, timestamp, file_exists, ip_stats_status) '
+        'VALUES (?, ?, ?, ?, ?)',
+        [
+            ('a', 'r1', day1, 1, None),
+            ('b', 'r1', day1 + 300, 0, None),
+            ('c', 'r1', day1 + 600, 1, 1),
+            ('d', 'r1', day2, 1, None),
+        ],
+    )
+
+    pending = discovery.get_files_needing_processing(conn, 'ip_stats', reprocess_window_days=0)
+    limited = discovery.get_files_needing_processing(conn, 'ip_stats', limit=1, reprocess_window_days=0)
+
+    assert pending == [('a', 'r1', day1, True), ('b', 'r1', day1 + 300, False)]
+    assert limited == [('a', 'r1', day1, True)]
+
+
+def test_mark_files_processed_sets_status_and_stamps_completed_rows() -> None:
+    common, discovery = load_modules()
+    conn = sqlite3.connect(':memory:', isolation_level=None)
+    common.init_processed_files_table(conn)
+    conn.executemany(
+        'INSERT INTO processed_files (file_path, router, timestamp, flow_stats_status, ip_stats_status, '
+        'protocol_stats_status, spectrum_stats_status) VALUES (?, ?, ?, 1, 1, 1, 1)',
+        [('a', 'r1', 100), ('b', 'r1', 400)],
+    )
+    conn.execute("INSERT INTO processed_files (file_path, router, timestamp) VALUES ('c', 'r1', 700)")
+
+    discovery.mark_files_processed(conn, 'structure_stats', [('a', True), ('b', False), ('c', True)])
+
+    rows = conn.execute(
+        'SELECT file_path, structure_stats_status, processed_at IS NOT NULL FROM processed_files ORDER BY file_path'
+    ).fetchall()
+    assert rows == [('a', 1, 1), ('b', 0, 1), ('c', 1, 0)]
+    assert not conn.in_transaction
+    with pytest.raises(ValueError):
+        discovery.mark_files_processed(conn, 'bogus_stats', [('a', True)])
+
+
+def test_group_files_by_day_uses_local_day_starts() -> None:
+    common, discovery = load_modules()
+    ts = common.timestamp_to_unix
+    files = [
+        ('a', 'r1', ts(datetime(2025, 3, 1, 23, 55)), True),
+        ('b', 'r1', ts(datetime(2025, 3, 2, 0, 0)), True),
+        ('c', 'r2', ts(datetime(2025, 3, 2, 12, 0)), False),
+        ('d', 'r1', ts(datetime(2025, 3, 1, 0, 0)), True),
+    ]
+
+    days = discovery.group_files_by_day(files)
+
+    assert days == {
+        ('r1', ts(datetime(2025, 3, 1))): [files[0], files[3]],
+        ('r1', ts(datetime(2025, 3, 2))): [files[1]],
+        ('r2', ts(datetime(2025, 3, 2))): [files[2]],
+    }
+
+
+def test_sync_processed_files_table_skips_gap_insert_for_routers_without_gaps(
+    monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture[str]
+) -> None:
+    common, discovery = load_modules()
+    conn = sqlite3.connect(':memory:')
+    common.init_processed_files_table(conn)
+
+    start = common.timestamp_to_unix(datetime(2025, 3, 1, 0, 0))
+    conn.executemany(
+        'INSERT INTO processed_files (file_path, router, timestamp, file_exists) VALUES (?, ?, ?, ?)',
+        [
+            ('a', 'r1', start, 1),
+            ('b', 'r1', start + 300, 0),
+            ('c', 'r1', start + 420, 1),
+            ('d', 'r1', start + 600, 1),
+            ('e', 'r2', start, 1),
+            ('f', 'r2', start + 420, 1),
+            ('g', 'r2', start + 600, 1),
+        ],
+    )
+    conn.commit()
+
+    monkeypatch.setattr(discovery, 'AVAILABLE_ROUTERS', ['r1', 'r2'])
+    monkeypatch.setattr(discovery, 'NETFLOW_DATA_PATH', '/captures')
+    monkeypatch.setattr(discovery, 'scan_filesystem', lambda discovery_window_days=0, *scan_cache: iter([]))
+
+    stats = discovery.sync_processed_files_table(conn, reprocess_window_days=0)
+
+    output = capsys.readouterr().out
+    assert stats['gaps'] == 1
+    assert 'Router r1: no gaps within active window' in output
+    assert 'Router r2: 1 new gap entries' in output
+    assert conn.execute(
+        'SELECT file_path, router, timestamp FROM processed_files WHERE file_exists = 0 AND router = ?',
+        ('r2',),
+    ).fetchall() == [('/captures/r2/2025/03/01/nfcapd.202503010005', 'r2', start + 300)]
+
+
+def test_handle_stale_days_resets_every_stale_day_in_one_transaction() -> None:
+    common, discovery = load_modules()
+    conn = sqlite3.connect(':memory:', isolation_level=None)
+    common.init_processed_files_table(conn)
+    conn.execute('CREATE TABLE ip_stats (router TEXT, bucket_start INTEGER)')
+
+    day1 = common.timestamp_to_unix(datetime(2025, 3, 1))
+    day2 = common.timestamp_to_unix(datetime(2025, 3, 2))
+    conn.executemany(
+        'INSERT INTO processed_files (file_path, router, timestamp, ip_stats_status) VALUES (?, ?, ?, ?)',
+        [
+            ('a', 'r1', day1, 1),
+            ('b', 'r1', day1 + 300, None),
+            ('c', 'r2', day2, 1),
+            ('d', 'r2', day2 + 300, None),
+            ('e', 'r2', day1, 1),
+        ],
+    )
+    conn.executemany(
+        'INSERT INTO ip_stats (router, bucket_start) VALUES (?, ?)',
+        [('r1', day1), ('r2', day2), ('r2', day1)],
+    )
+    changes_before = conn.total_changes
+
+    summary = discovery.handle_stale_days(conn, 'ip_stats', reprocess_window_days=0)
+
+    assert not conn.in_transaction
+    assert summary['stale_days_reset'] == 2
+    assert summary['total_stats_deleted'] == 2
+    assert summary['total_files_reset'] == 4
+    assert conn.total_changes - changes_before == 6
+    assert conn.execute('SELECT router, bucket_start FROM ip_stats').fetchall() == [('r2', day1)]
+    assert conn.execute(
+        'SELECT file_path FROM processed_files WHERE ip_stats_status IS NOT NULL'
+    ).fetchall() == [('e',)]
+
+
+def test_get_stale_days_works_without_pending_indexes() -> None:
+    common, discovery = load_modules()
+    conn = sqlite3.connect(':memory:')
+    conn.execute(
+        'CREATE TABLE processed_files (file_path TEXT PRIMARY KEY, router TEXT, '
+        'timestamp INTEGER, ip_stats_status INTEGER)'
+    )
+
+    day1 = common.timestamp_to_unix(datetime(2025, 3, 1))
+    conn.executemany(
+        'INSERT INTO processed_files VALUES (?, ?, ?, ?)',
+        [('a', 'r1', day1, 1), ('b', 'r1', day1 + 300, None), ('c', 'r2', day1, None)],
+    )
+
+    assert discovery.get_stale_days(conn, 'ip_stats') == {('r1', day1)}
+
+
+def test_count_pending_files_matches_get_pending_files() -> None:
+    common, discovery = load_modules()
+    conn = sqlite3.connect(':memory:')
+    common.init_processed_files_table(conn)
+
+    old = common.timestamp_to_unix(datetime(2020, 1, 1))
+    recent = common.timestamp_to_unix(datetime.now().replace(microsecond=0))
+    conn.executemany(
+        'INSERT INTO processed_files (file_path, router, timestamp, file_exists, processed_at) '
+        'VALUES (?, ?, ?, ?, ?)',
+        [
+            ('old-file', 'r1', old, 1, None),
+            ('old-gap', 'r1', old + 300, 0, None),
+            ('recent-gap', 'r1', recent, 0, None),
+            ('done', 'r1', recent + 300, 1, '2025-01-01 00:00:00'),
+        ],
+    )
+
+    for window in (0, 30):
+        pending = discovery.get_pending_files(conn, reprocess_window_days=window)
+        assert discovery.count_pending_files(conn, reprocess_window_days=window) == len(pending)
+    assert discovery.count_pending_files(conn, reprocess_window_days=30) == 2
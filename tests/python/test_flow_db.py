@@ -1,6 +1,8 @@
 import importlib
 import sqlite3
 
+import pytest
+
 
 def load_modules():
     common = importlib.import_module('common')
@@ -16,6 +18,14 @@ def test_parse_nfdump_output_parses_numeric_fields() -> None:
     assert parsed == {'flows': 12, 'bytes_tcp': 99, 'ident': 'router-1'}
 
 
+def test_parse_nfdump_output_accepts_signed_and_crlf_numbers() -> None:
+    _, flow_db = load_modules()
+
+    parsed = flow_db.parse_nfdump_output('Flows: -1\r\nPackets: +5\r\nBytes: 7 \r\nIdent: r1\r\n')
+
+    assert parsed == {'flows': -1, 'packets': 5, 'bytes': 7, 'ident': 'r1'}
+
+
 def test_process_file_worker_returns_zero_stats_for_gap_placeholder() -> None:
     _, flow_db = load_modules()
 
@@ -93,3 +103,63 @@ def test_batch_insert_results_replaces_mirrored_path_duplicate() -> None:
     ).fetchall()
     assert inserted == 1
     assert rows == [('/new-root/a', 'r1', 123, 7, 8, 9)]
+
+
+def test_process_pending_files_writes_gap_rows_and_marks_status() -> None:
+    common, flow_db = load_modules()
+    conn = sqlite3.connect(':memory:', isolation_level=None)
+    common.init_processed_files_table(conn)
+    day_start = 1_740_787_200
+    conn.executemany(
+        'INSERT INTO processed_files (file_path, router, timestamp, file_exists) VALUES (?, ?, ?, ?)',
+        [
+            ('/captures/r1/a', 'r1', day_start, 0),
+            ('/captures/r1/b', 'r1', day_start + 300, 0),
+            ('/captures/r1/next-day', 'r1', day_start + 2 * 86400, 1),
+        ],
+    )
+
+    stats = flow_db.process_pending_files(conn, reprocess_window_days=0)
+
+    assert stats == {'processed': 2, 'errors': 0, 'attempted': 2}
+    assert conn.execute('SELECT COUNT(*), SUM(flows) FROM netflow_stats').fetchone() == (2, 0)
+    assert conn.execute(
+        'SELECT COUNT(*) FROM processed_files WHERE flow_stats_status = 1'
+    ).fetchone() == (2,)
+
+
+def test_init_netflow_stats_table_keeps_only_non_redundant_indexes() -> None:
+    _, flow_db = load_modules()
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE netflow_stats (id INTEGER PRIMARY KEY, file_path TEXT UNIQUE, router TEXT, timestamp INTEGER)')
+    conn.execute('CREATE INDEX idx_router_timestamp ON netflow_stats (router, timestamp)')
+    conn.execute('CREATE INDEX idx_file_path ON netflow_stats (file_path)')
+
+    flow_db.init_netflow_stats_table(conn)
+
+    indexes = {row[1] for row in conn.execute('PRAGMA index_list(netflow_stats)')}
+    assert indexes == {'idx_netflow_router_timestamp_unique', 'sqlite_autoindex_netflow_stats_1'}
+
+
+def test_process_pending_files_runs_inline_with_one_worker(monkeypatch: pytest.MonkeyPatch) -> None:
+    common, flow_db = load_modules()
+    conn = sqlite3.connect(':memory:', isolation_level=None)
+    common.init_processed_files_table(conn)
+    day_start = 1_740_787_200
+    conn.executemany(
+        'INSERT INTO processed_files (file_path, router, timestamp, file_exists) VALUES (?, ?, ?, ?)',
+        [
+            ('/captures/r1/a', 'r1', day_start, 0),
+            ('/captures/r1/next-day', 'r1', day_start + 2 * 86400, 1),
+        ],
+    )
+
+    def no_pool(*args, **kwargs):
+        raise AssertionError('Pool should not be created for a single worker')
+
+    monkeypatch.setattr(flow_db, 'MAX_WORKERS', 1)
+    monkeypatch.setattr(flow_db, 'Pool', no_pool)
+
+    stats = flow_db.process_pending_files(conn, reprocess_window_days=0)
+
+    assert stats == {'processed': 1, 'errors': 0, 'attempted': 1}
@@ -0,0 +1,108 @@
+import importlib
+import os
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+
+def load_modules():
+    common = importlib.import_module('common')
+    ip_db = importlib.import_module('ip_db')
+    return importlib.reload(common), importlib.reload(ip_db)
+
+
+def install_fake_nfdump(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, sources: str, destinations: str) -> None:
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    nfdump = bin_dir / 'nfdump'
+    nfdump.write_text(
+        "#!/bin/sh\n"
+        'case "$*" in\n'
+        f"  *srcip*) cat <<'OUT'\n{sources}OUT\n  ;;\n"
+        f"  *dstip*) cat <<'OUT'\n{destinations}OUT\n  ;;\n"
+        "esac\n"
+    )
+    nfdump.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{bin_dir}:{os.environ['PATH']}")
+
+
+def test_process_file_counts_both_families_from_aggregated_nfdump_passes(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    _, ip_db = load_modules()
+    install_fake_nfdump(
+        tmp_path,
+        monkeypatch,
+        sources='     10.0.0.1\n   2001:db8::1\n',
+        destinations='     10.0.0.2\n     10.0.0.3\n   2001:db8::2\n',
+    )
+
+    result = ip_db.process_file(('/captures/nfcapd.202503010000', 'r1', 123, True))
+
+    assert result['success'] is True
+    assert result['data'] == {
+        'sa_ipv4_count': 1,
+        'da_ipv4_count': 2,
+        'sa_ipv6_count': 1,
+        'da_ipv6_count': 1,
+    }
+
+
+def test_process_file_returns_zero_counts_for_gap_placeholder() -> None:
+    _, ip_db = load_modules()
+
+    result = ip_db.process_file(('/captures/missing', 'r1', 123, False))
+
+    assert result['success'] is True
+    assert result['data']['sa_ipv4_count'] == 0
+
+
+def test_compute_aggregates_rolls_up_distinct_addresses() -> None:
+    common, ip_db = load_modules()
+    day_start = common.timestamp_to_unix(datetime(2025, 3, 1))
+
+    def result(minutes: int, sources: set[bytes]) -> dict:
+        raw = {'sa_v4': sources, 'da_v4': set(), 'sa_v6': set(), 'da_v6': set()}
+        return {'success': True, 'timestamp': day_start + minutes * 60, 'raw_ips': raw}
+
+    results = [
+        result(0, {b'\x0a\x00\x00\x01', b'\x0a\x00\x00\x02'}),
+        result(25, {b'\x0a\x00\x00\x02'}),
+        result(35, {b'\x0a\x00\x00\x03'}),
+        result(60, {b'\x0a\x00\x00\x01'}),
+        {'success': False, 'timestamp': day_start + 65 * 60, 'raw_ips': None},
+    ]
+
+    counts = {
+        (row['granularity'], row['bucket_start'] - day_start): row['sa_ipv4_count']
+        for row in ip_db.compute_aggregates(results, 'r1', day_start)
+    }
+
+    assert counts == {
+        ('30m', 0): 2,
+        ('30m', 1800): 1,
+        ('30m', 3600): 1,
+        ('1h', 0): 3,
+        ('1h', 3600): 1,
+        ('1d', 0): 3,
+    }
+
+
+def test_insert_results_writes_5m_and_aggregate_rows() -> None:
+    _, ip_db = load_modules()
+    conn = sqlite3.connect(':memory:')
+    ip_db.init_ip_stats_table(conn)
+    counts = {'sa_ipv4_count': 2, 'da_ipv4_count': 3, 'sa_ipv6_count': 0, 'da_ipv6_count': 1}
+
+    inserted = ip_db.insert_results(
+        conn,
+        [{'router': 'r1', 'granularity': '5m', 'bucket_start': 0, 'bucket_end': 300, **counts}],
+        [{'router': 'r1', 'granularity': '1d', 'bucket_start': 0, 'bucket_end': 86400, **counts}],
+    )
+
+    assert inserted == (1, 1)
+    assert conn.execute(
+        'SELECT granularity, bucket_end, sa_ipv4_count, da_ipv6_count FROM ip_stats ORDER BY bucket_end'
+    ).fetchall() == [('5m', 300, 2, 1), ('1d', 86400, 2, 1)]
@@ -8,16 +8,36 @@ path utilities.
 import json
 import os
 import sqlite3
+import subprocess
+import tempfile
+import threading
 from pathlib import Path
 from datetime import datetime
-from typing import Any, Optional
+from typing import Any, Iterator, Optional
 from contextlib import contextmanager
+from functools import lru_cache
 
 
 REPO_ROOT = Path(__file__).resolve().parents[2]
 DEFAULT_ENV_PATH = REPO_ROOT / '.env'
 DEFAULT_DATASETS_PATH = REPO_ROOT / 'datasets.json'
 DEFAULT_DATA_START_DATE = datetime(2025, 2, 1)
+NFDUMP_TIMEOUT_SECONDS = 300
+
+# Processor tables, each tracked by a <table>_status column in processed_files
+PROCESSOR_TABLES = ('flow_stats', 'ip_stats', 'protocol_stats', 'spectrum_stats', 'structure_stats')
+
+# 1 once every processor has recorded a status for a processed_files row.
+# VIRTUAL because ALTER TABLE cannot add STORED columns to existing databases.
+ALL_DONE_COLUMN_SQL = """
+    all_done INTEGER GENERATED ALWAYS AS (
+        flow_stats_status IS NOT NULL
+        AND ip_stats_status IS NOT NULL
+        AND protocol_stats_status IS NOT NULL
+        AND spectrum_stats_status IS NOT NULL
+        AND structure_stats_status IS NOT NULL
+    ) VIRTUAL
+"""
 
 
 class ConfigurationError(RuntimeError):
@@ -28,22 +48,22 @@ def load_env_file(env_path: Optional[str] = None) -> None:
     """
     Load environment variables from a dotenv-style file into os.environ.
     
-    Reads the file at env_path (default repo-level '.env'), ignoring empty lines
-    and lines starting with '#'. Each non-comment line containing '=' is split on
-    the first '=' and the left/right parts are stripped and set as KEY=VALUE in
-    os.environ.
+    Reads the file at env_path (default repo-level '.env') in one read, ignoring
+    empty lines and lines starting with '#'. Each non-comment line containing '='
+    is partitioned on the first '=' and the left/right parts are stripped and set
+    as KEY=VALUE in os.environ.
     
-    If the file does not exist, prints an error message and exits the process with
-    status code 1.
+    If the file does not exist, raises ConfigurationError.
     """
     env_file = DEFAULT_ENV_PATH if env_path is None else Path(env_path).expanduser()
     if env_file.exists():
         with open(env_file, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#') and '=' in line:
-                    key, value = line.split('=', 1)
-                    os.environ[key.strip()] = value.strip()
+            content = f.read()
+        for line in content.splitlines():
+            key, separator, value = line.partition('=')
+            key = key.strip()
+            if separator and key and not key.startswith('#'):
+                os.environ[key] = value.strip()
     else:
         raise ConfigurationError(
             f"Environment file '{env_file}' not found. Please copy .env.example to .env and configure your settings."
@@ -307,16 +327,47 @@ if get_optional_env('NETFLOW_DB_SKIP_AUTO_INIT') != '1':
     initialize_runtime()
 
 
+def configure_connection(conn: sqlite3.Connection, readonly: bool = False) -> None:
+    """
+    Apply the session PRAGMAs used by every pipeline connection.
+
+    WAL keeps readers on consistent snapshots while the single writer commits,
+    so ``synchronous=NORMAL`` only fsyncs at checkpoints instead of per commit.
+
+    Args:
+        conn: Connection to configure
+        readonly: If True, skip settings that write to the database file
+            (``journal_mode``) or only affect writers (``synchronous``)
+    """
+    conn.execute("PRAGMA busy_timeout=60000;")
+    if not readonly:
+        # journal_mode is persisted in the database file, so inspection-only
+        # connections leave it as they found it.
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    conn.execute("PRAGMA cache_size=-65536;")
+    conn.execute("PRAGMA mmap_size=268435456;")
+    conn.execute("PRAGMA wal_autocheckpoint=1000;")
+
+
 @contextmanager
-def get_db_connection(wal_mode: bool = True, db_path: Optional[str | Path] = None):
+def get_db_connection(
+    wal_mode: bool = True,
+    db_path: Optional[str | Path] = None,
+    readonly: bool = False,
+):
     """
     Context manager for database connections with optional WAL mode.
-    
+
     Args:
-        wal_mode: If True, enables WAL journal mode and sets busy timeout.
+        wal_mode: If True, enables WAL journal mode, busy timeout, and the
+                  performance PRAGMAs from configure_connection.
                   Recommended for concurrent access.
         db_path: Optional path to the SQLite database. Defaults to DATABASE_PATH.
-    
+        readonly: If True, skips write-only PRAGMAs such as ``synchronous``
+                  and the ``PRAGMA optimize`` run on close.
+
     Yields:
         sqlite3.Connection object
     """
@@ -327,13 +378,86 @@ def get_db_connection(wal_mode: bool = True, db_path: Optional[str | Path] = Non
     conn = sqlite3.connect(db_file, isolation_level=None)
     try:
         if wal_mode:
-            conn.execute("PRAGMA journal_mode=WAL;")
-            conn.execute("PRAGMA busy_timeout=60000;")
+            configure_connection(conn, readonly=readonly)
         yield conn
+        # Refresh planner statistics on clean writer exits only; a failure here
+        # must not mask the caller's work or keep the connection open.
+        if wal_mode and not readonly:
+            try:
+                conn.execute("PRAGMA optimize;")
+            except sqlite3.Error as e:
+                print(f"Warning: PRAGMA optimize failed: {e}")
     finally:
         conn.close()
 
 
+# Niceness added to processor pool workers; nfdump children inherit it, so
+# ingest yields the CPU to the web server and interactive queries on the host.
+WORKER_NICENESS = 5
+
+
+def init_worker_process() -> None:
+    """Pool initializer for processor workers: lower their CPU priority."""
+    os.nice(WORKER_NICENESS)
+
+
+def iter_nfdump_lines(args: list[str], timeout: float = NFDUMP_TIMEOUT_SECONDS) -> Iterator[str]:
+    """
+    Run nfdump and yield its stdout line by line while it is still running.
+
+    Streaming keeps peak memory bounded by the pipe buffer instead of the full
+    output size and overlaps parsing with nfdump's own decoding work.
+
+    Args:
+        args: nfdump arguments (without the leading 'nfdump')
+        timeout: Seconds before nfdump is killed
+
+    Yields:
+        Raw output lines, including the trailing newline
+
+    Raises:
+        subprocess.TimeoutExpired: If nfdump did not finish within timeout
+        subprocess.CalledProcessError: If nfdump exited with a non-zero status
+    """
+    # stderr goes to a temp file rather than a pipe: a pipe left unread while
+    # stdout is drained fills up on noisy files and blocks nfdump until killed.
+    with tempfile.TemporaryFile() as stderr_file, subprocess.Popen(
+        ["nfdump", *args],
+        stdout=subprocess.PIPE,
+        stderr=stderr_file,
+        text=True,
+        bufsize=1 << 20,
+    ) as proc:
+        timer = threading.Timer(timeout, proc.kill)
+        timer.start()
+        try:
+            yield from proc.stdout
+            returncode = proc.wait()
+        finally:
+            timed_out = not timer.is_alive()
+            timer.cancel()
+        stderr_file.seek(0)
+        stderr = stderr_file.read().decode(errors="replace")
+
+    if timed_out:
+        raise subprocess.TimeoutExpired(proc.args, timeout)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, proc.args, stderr=stderr)
+
+
+# "HHMM" suffix for every minute of the day, indexed by hour * 60 + minute
+_MINUTE_SUFFIXES = tuple(f"{hour:02d}{minute:02d}" for hour in range(24) for minute in range(60))
+
+
+@lru_cache(maxsize=4096)
+def _day_file_prefix(data_path: str, router: str, year: int, month: int, day: int) -> str:
+    """Return '<day dir>/nfcapd.YYYYMMDD' for a router, memoized per calendar day."""
+    return (
+        f"{data_path}/{router}/{year:04d}/{month:02d}/{day:02d}/"
+        f"nfcapd.{year:04d}{month:02d}{day:02d}"
+    )
+
+
 def construct_file_path(router: str, timestamp: datetime) -> str:
     """
     Construct the expected file path for a NetFlow capture file.
@@ -345,12 +469,36 @@ def construct_file_path(router: str, timestamp: datetime) -> str:
     Returns:
         Full path to the expected nfcapd file
     """
-    timestamp_str = timestamp.strftime('%Y%m%d%H%M')
-    year = timestamp.strftime('%Y')
-    month = timestamp.strftime('%m')
-    day = timestamp.strftime('%d')
-    
-    return f"{NETFLOW_DATA_PATH}/{router}/{year}/{month}/{day}/nfcapd.{timestamp_str}"
+    prefix = _day_file_prefix(NETFLOW_DATA_PATH, router, timestamp.year, timestamp.month, timestamp.day)
+    return prefix + _MINUTE_SUFFIXES[timestamp.hour * 60 + timestamp.minute]
+
+
+@lru_cache(maxsize=65536)
+def parse_nfcapd_timestamp(timestamp_str: str) -> datetime:
+    """
+    Parse the 12-digit YYYYMMDDHHMM suffix of an nfcapd filename.
+
+    Memoized because rescans and per-router layouts repeat the same suffixes.
+
+    Raises:
+        ValueError: If the suffix is not 12 digits or not a valid time
+    """
+    if len(timestamp_str) != 12 or not timestamp_str.isdigit():
+        raise ValueError(f"Invalid nfcapd timestamp: {timestamp_str}")
+
+    return datetime(
+        int(timestamp_str[0:4]),
+        int(timestamp_str[4:6]),
+        int(timestamp_str[6:8]),
+        int(timestamp_str[8:10]),
+        int(timestamp_str[10:12]),
+    )
+
+
+@lru_cache(maxsize=65536)
+def nfcapd_timestamp_to_unix(timestamp_str: str) -> int:
+    """Return the local-time unix timestamp for a 12-digit nfcapd suffix."""
+    return int(parse_nfcapd_timestamp(timestamp_str).timestamp())
 
 
 def parse_file_path(file_path: str) -> tuple[str, datetime]:
@@ -366,34 +514,25 @@ def parse_file_path(file_path: str) -> tuple[str, datetime]:
     Raises:
         ValueError: If the file path cannot be parsed
     """
-    path = Path(file_path)
-    filename = path.name  # e.g., 'nfcapd.202403010000'
+    # Path layout: .../router/year/month/day/nfcapd.YYYYMMDDHHMM
+    parts = file_path.rsplit('/', 5)
+    filename = parts[-1]
     
     if not filename.startswith('nfcapd.'):
         raise ValueError(f"Invalid NetFlow filename: {filename}")
     
-    timestamp_str = filename.split('.')[1]  # '202403010000'
+    timestamp_str = filename[7:].partition('.')[0]  # '202403010000'
     
     if len(timestamp_str) != 12:
         raise ValueError(f"Invalid timestamp format in filename: {filename}")
     
-    year = int(timestamp_str[0:4])
-    month = int(timestamp_str[4:6])
-    day = int(timestamp_str[6:8])
-    hour = int(timestamp_str[8:10])
-    minute = int(timestamp_str[10:12])
-    
-    timestamp = datetime(year, month, day, hour, minute)
+    timestamp = parse_nfcapd_timestamp(timestamp_str)
     
-    # Extract router from path: .../router/year/month/day/nfcapd.timestamp
-    # Path parts: ['', 'path', 'to', 'netflow', 'router', 'year', 'month', 'day', 'nfcapd.xxx']
-    parts = file_path.split('/')
     # Router is 4 levels up from the filename
-    router_idx = len(parts) - 5
-    if router_idx < 0:
+    if len(parts) < 5:
         raise ValueError(f"Cannot extract router from path: {file_path}")
     
-    router = parts[router_idx]
+    router = parts[-5]
     
     return router, timestamp
 
@@ -415,7 +554,7 @@ def init_processed_files_table(conn: sqlite3.Connection) -> None:
     This table centralizes tracking of all NetFlow files (both existing and gap placeholders).
     """
     cursor = conn.cursor()
-    cursor.execute("""
+    cursor.execute(f"""
         CREATE TABLE IF NOT EXISTS processed_files (
             file_path TEXT PRIMARY KEY,
             router TEXT NOT NULL,
@@ -428,9 +567,14 @@ def init_processed_files_table(conn: sqlite3.Connection) -> None:
             ip_stats_status INTEGER,
             protocol_stats_status INTEGER,
             spectrum_stats_status INTEGER,
-            structure_stats_status INTEGER
+            structure_stats_status INTEGER,
+            {ALL_DONE_COLUMN_SQL}
         )
     """)
+
+    columns = {row[1] for row in cursor.execute("PRAGMA table_xinfo(processed_files)")}
+    if 'all_done' not in columns:
+        cursor.execute(f"ALTER TABLE processed_files ADD COLUMN {ALL_DONE_COLUMN_SQL}")
     
     cursor.execute("""
         CREATE INDEX IF NOT EXISTS idx_processed_files_timestamp 
@@ -451,10 +595,57 @@ def init_processed_files_table(conn: sqlite3.Connection) -> None:
         print("Warning: processed_files has duplicate router/timestamp rows; "
               "skipping unique index creation until repaired")
 
+    # Covers the data-horizon lookup (MAX(timestamp) WHERE file_exists = 1)
+    # so it resolves with a single index seek instead of a table scan.
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_processed_files_exists_timestamp 
+        ON processed_files(file_exists, timestamp)
+    """)
+
+    # Serves the per-router MIN(timestamp) WHERE file_exists = 1 gap-scan start
     cursor.execute("""
-        CREATE INDEX IF NOT EXISTS idx_processed_files_pending 
-        ON processed_files(processed_at) 
+        CREATE INDEX IF NOT EXISTS idx_processed_files_router_exists_timestamp 
+        ON processed_files(router, file_exists, timestamp)
+    """)
+
+    # Pending rows in timestamp order; replaces the processed_at-keyed partial
+    # index, whose single NULL key could not serve the ORDER BY.
+    cursor.execute("DROP INDEX IF EXISTS idx_processed_files_pending")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_processed_files_pending_timestamp 
+        ON processed_files(timestamp) 
         WHERE processed_at IS NULL
     """)
-    
+
+    # Rows whose statuses are complete but whose processed_at is not yet stamped
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_processed_files_all_done_pending 
+        ON processed_files(all_done) 
+        WHERE processed_at IS NULL
+    """)
+
+    # One pending index per processor so each work-queue query is an ordered
+    # range scan over that processor's unprocessed rows only.
+    for table_name in PROCESSOR_TABLES:
+        cursor.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_processed_files_{table_name}_pending 
+            ON processed_files(timestamp) 
+            WHERE {table_name}_status IS NULL
+        """)
+
+    # Day directory mtimes and file counts from the last discovery scan; a
+    # directory whose mtime is unchanged has had no files added, removed, or
+    # renamed since, and the count shows whether its rows are all still there.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS scan_cache (
+            dir_path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            file_count INTEGER NOT NULL
+        )
+    """)
+    scan_cache_columns = {row[1] for row in cursor.execute("PRAGMA table_info(scan_cache)")}
+    if 'file_count' not in scan_cache_columns:
+        # -1 never matches a row count, so older entries are rescanned once
+        cursor.execute("ALTER TABLE scan_cache ADD COLUMN file_count INTEGER NOT NULL DEFAULT -1")
+
     conn.commit()
@@ -5,22 +5,51 @@ Handles filesystem scanning, gap detection, and processed_files table synchroniz
 """
 
 import os
+import queue
 import sqlite3
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from pathlib import Path
-from typing import Iterator, Optional
+from typing import Container, Iterator, Mapping, Optional
 
 from common import (
     NETFLOW_DATA_PATH,
     AVAILABLE_ROUTERS,
     DATA_START_DATE,
-    construct_file_path,
     parse_file_path,
+    nfcapd_timestamp_to_unix,
     timestamp_to_unix,
     unix_to_timestamp,
     init_processed_files_table,
+    PROCESSOR_TABLES,
 )
 
+# Discovered files written per transaction during sync
+SYNC_BATCH_SIZE = 5000
+
+# Expected spacing of nfcapd captures
+GAP_INTERVAL_MINUTES = 5
+
+# Router scan threads hand results to the consumer in pages of this many files,
+# with at most SCAN_QUEUE_PAGES pages buffered.
+SCAN_PAGE_SIZE = 1000
+SCAN_QUEUE_PAGES = 32
+
+# processed_files status column per processor table; also the whitelist that
+# keeps table names out of SQL unless they are known.
+STATUS_COLUMNS = {table_name: f"{table_name}_status" for table_name in PROCESSOR_TABLES}
+
+# Per-table status update, built once so each call binds parameters only
+_SET_STATUS_SQL = {
+    table_name: f"""
+        UPDATE processed_files
+        SET {status_column} = ?
+        WHERE file_path = ?
+    """
+    for table_name, status_column in STATUS_COLUMNS.items()
+}
+
 
 def iter_scan_days(discovery_window_days: int = 0) -> Iterator[datetime]:
     """
@@ -39,36 +68,177 @@ def iter_scan_days(discovery_window_days: int = 0) -> Iterator[datetime]:
         current += timedelta(days=1)
 
 
-def scan_filesystem(discovery_window_days: int = 0) -> Iterator[tuple[str, str, datetime]]:
+def _numeric_subdirs(path: str, wanted: Container[int]) -> list[tuple[int, str]]:
     """
-    Scan the filesystem within the configured discovery window and yield nfcapd files.
+    Return (number, path) for all-digit subdirectories of path whose number is wanted.
 
-    Yields:
-        Tuples of (file_path, router, timestamp) for each discovered file
+    Entries are pruned on their name before the DirEntry type check, and only
+    the survivors are sorted (as ints, so ordering does not depend on padding).
+    """
+    with os.scandir(path) as entries:
+        matches = []
+        for entry in entries:
+            name = entry.name
+            if name.isdigit() and int(name) in wanted and entry.is_dir():
+                matches.append((int(name), entry.path))
+    matches.sort()
+    return matches
+
+
+def _iter_day_dirs(
+    router_path: str, scan_days: set[tuple[int, int, int]]
+) -> Iterator[tuple[tuple[int, int, int], str]]:
     """
-    base_path = Path(NETFLOW_DATA_PATH)
-    scan_days = list(iter_scan_days(discovery_window_days))
+    Yield ((year, month, day), path) for existing YYYY/MM/DD directories under
+    a router that fall in scan_days.
 
-    for router in AVAILABLE_ROUTERS:
-        router_path = base_path / router
-        if not router_path.exists():
-            print(f"Warning: Router path does not exist: {router_path}")
-            continue
+    Walks the tree with os.scandir so only directories that exist are opened,
+    rather than probing every calendar day in the window.
+    """
+    wanted_days: dict[int, dict[int, set[int]]] = {}
+    for year, month, day in scan_days:
+        wanted_days.setdefault(year, {}).setdefault(month, set()).add(day)
 
-        for day_start in scan_days:
-            day_dir = router_path / day_start.strftime('%Y') / day_start.strftime('%m') / day_start.strftime('%d')
-            if not day_dir.is_dir():
+    for year, year_path in _numeric_subdirs(router_path, wanted_days):
+        months = wanted_days[year]
+        for month, month_path in _numeric_subdirs(year_path, months):
+            for day, day_path in _numeric_subdirs(month_path, months[month]):
+                yield (year, month, day), day_path
+
+
+def _scan_router(
+    router: str,
+    scan_days: set[tuple[int, int, int]],
+    dir_mtimes: Optional[Mapping[str, int]] = None,
+    scanned_dirs: Optional[dict[str, tuple[int, int]]] = None,
+) -> Iterator[tuple[str, str, int]]:
+    """
+    Yield (file_path, router, unix_timestamp) for one router's nfcapd files in scan_days.
+
+    With dir_mtimes, day directories whose mtime matches the cached value are
+    skipped, and the (mtime, files yielded) of each directory listed is stored
+    in scanned_dirs. Today's directory is always listed and never cached.
+    """
+    router_path = f"{NETFLOW_DATA_PATH}/{router}"
+    if not os.path.isdir(router_path):
+        print(f"Warning: Router path does not exist: {router_path}")
+        return
+
+    # Fixed-width YYYYMMDDHHMM stamps order like the times they encode, so the
+    # start filter runs on the raw stamp before any conversion.
+    start_stamp = DATA_START_DATE.strftime('%Y%m%d%H%M')
+    start_unix = timestamp_to_unix(DATA_START_DATE)
+    today = datetime.now()
+    today_key = (today.year, today.month, today.day)
+    for day_key, day_dir in _iter_day_dirs(router_path, scan_days):
+        mtime_ns = None
+        if dir_mtimes is not None and day_key != today_key:
+            mtime_ns = os.stat(day_dir).st_mtime_ns
+            if dir_mtimes.get(day_dir) == mtime_ns:
                 continue
 
-            for file_path in sorted(day_dir.glob('nfcapd.*')):
-                try:
-                    router_parsed, timestamp = parse_file_path(str(file_path))
-                    if timestamp < DATA_START_DATE:
+        with os.scandir(day_dir) as entries:
+            file_names = sorted(
+                entry.name for entry in entries if entry.name.startswith('nfcapd.')
+            )
+
+        file_count = 0
+        for file_name in file_names:
+            file_path = f"{day_dir}/{file_name}"
+            stamp = file_name[7:]
+            try:
+                if len(stamp) == 12 and stamp.isdigit():
+                    if stamp < start_stamp:
                         continue
-                    yield str(file_path), router_parsed, timestamp
-                except ValueError as e:
-                    print(f"Warning: Could not parse file {file_path}: {e}")
+                    # The walk already knows the router; only the stamp needs parsing
+                    router_parsed, timestamp_unix = router, nfcapd_timestamp_to_unix(stamp)
+                else:
+                    router_parsed, timestamp = parse_file_path(file_path)
+                    timestamp_unix = timestamp_to_unix(timestamp)
+                    if timestamp_unix < start_unix:
+                        continue
+                yield file_path, router_parsed, timestamp_unix
+                file_count += 1
+            except ValueError as e:
+                print(f"Warning: Could not parse file {file_path}: {e}")
+                continue
+
+        if mtime_ns is not None:
+            scanned_dirs[day_dir] = (mtime_ns, file_count)
+
+
+def scan_filesystem(
+    discovery_window_days: int = 0,
+    dir_mtimes: Optional[Mapping[str, int]] = None,
+    scanned_dirs: Optional[dict[str, tuple[int, int]]] = None,
+) -> Iterator[tuple[str, str, int]]:
+    """
+    Scan the filesystem within the configured discovery window and yield nfcapd files.
+
+    Routers are disjoint subtrees, so each is walked on its own thread (the
+    GIL is released during readdir) and pages of results are handed to the
+    calling thread through a bounded queue. Files from different routers may
+    interleave; each router's files keep their on-disk order.
+
+    Args:
+        discovery_window_days: Days to scan back from today; ``0`` means all
+            days from ``DATA_START_DATE``.
+        dir_mtimes: Cached day directory mtimes (see scan_cache); unchanged
+            directories are skipped.
+        scanned_dirs: Receives (mtime, files yielded) for every day directory
+            listed, for writing back to scan_cache.
+
+    Yields:
+        Tuples of (file_path, router, unix_timestamp) for each discovered file
+    """
+    scan_days = {
+        (day.year, day.month, day.day)
+        for day in iter_scan_days(discovery_window_days)
+    }
+    routers = list(AVAILABLE_ROUTERS)
+    if len(routers) <= 1:
+        for router in routers:
+            yield from _scan_router(router, scan_days, dir_mtimes, scanned_dirs)
+        return
+
+    pages: queue.Queue = queue.Queue(maxsize=SCAN_QUEUE_PAGES)
+    cancelled = threading.Event()
+
+    def scan_into_queue(router: str) -> None:
+        page = []
+        try:
+            for item in _scan_router(router, scan_days, dir_mtimes, scanned_dirs):
+                page.append(item)
+                if len(page) >= SCAN_PAGE_SIZE:
+                    pages.put(page)
+                    page = []
+                    if cancelled.is_set():
+                        return
+            if page:
+                pages.put(page)
+        finally:
+            # One sentinel per router marks its completion, even on error
+            pages.put(None)
+
+    with ThreadPoolExecutor(max_workers=len(routers)) as executor:
+        futures = [executor.submit(scan_into_queue, router) for router in routers]
+        remaining = len(routers)
+        try:
+            while remaining:
+                page = pages.get()
+                if page is None:
+                    remaining -= 1
                     continue
+                yield from page
+        finally:
+            # If the consumer stopped early, unblock producers waiting on put()
+            cancelled.set()
+            while remaining:
+                if pages.get() is None:
+                    remaining -= 1
+
+        for future in futures:
+            future.result()
 
 
 def compute_data_horizon(conn: sqlite3.Connection) -> datetime:
@@ -95,52 +265,6 @@ def compute_data_horizon(conn: sqlite3.Connection) -> datetime:
     return DATA_START_DATE
 
 
-def identify_gaps(
-    conn: sqlite3.Connection,
-    router: str,
-    start_time: datetime,
-    end_time: datetime,
-    interval_minutes: int = 5
-) -> list[datetime]:
-    """
-    Identify missing timestamps for a router within a time range.
-    
-    Args:
-        conn: Database connection
-        router: Router name to check
-        start_time: Start of the time range
-        end_time: End of the time range (exclusive, this is the data horizon)
-        interval_minutes: Expected interval between files (default 5 minutes)
-        
-    Returns:
-        List of datetime objects representing missing timestamps
-    """
-    cursor = conn.cursor()
-    
-    # Get all existing timestamps for this router in the range
-    existing = set()
-    rows = cursor.execute("""
-        SELECT timestamp FROM processed_files 
-        WHERE router = ? AND timestamp >= ? AND timestamp < ?
-    """, (router, timestamp_to_unix(start_time), timestamp_to_unix(end_time))).fetchall()
-    
-    for row in rows:
-        existing.add(row[0])
-    
-    # Generate expected timestamps
-    gaps = []
-    current = start_time
-    delta = timedelta(minutes=interval_minutes)
-    
-    while current < end_time:
-        unix_ts = timestamp_to_unix(current)
-        if unix_ts not in existing:
-            gaps.append(current)
-        current += delta
-    
-    return gaps
-
-
 def get_reprocess_cutoff_dt(reprocess_window_days: int = 30) -> Optional[datetime]:
     """
     Return the start-of-day cutoff for the active reprocessing window.
@@ -182,6 +306,100 @@ def get_discovery_start_dt(discovery_window_days: int = 0) -> datetime:
     return max(DATA_START_DATE.replace(hour=0, minute=0, second=0, microsecond=0), cutoff_dt)
 
 
+# Insert a discovered file only when no row exists for (router, timestamp); the
+# unique index may be absent on databases that still hold duplicate rows.
+INSERT_MISSING_SLOT_SQL = """
+    INSERT OR IGNORE INTO processed_files
+    (file_path, router, timestamp, file_exists, discovered_at)
+    SELECT ?1, ?2, ?3, 1, CURRENT_TIMESTAMP
+    WHERE NOT EXISTS (
+        SELECT 1 FROM processed_files WHERE router = ?2 AND timestamp = ?3
+    )
+"""
+
+# Gap placeholders for one router in one statement: generate the expected grid
+# in [?3, ?4) with step ?5 and insert each slot that has no row. The path is
+# built from local time exactly as construct_file_path does.
+INSERT_GAP_SLOTS_SQL = """
+    INSERT OR IGNORE INTO processed_files
+    (file_path, router, timestamp, file_exists, discovered_at)
+    WITH RECURSIVE slots(ts) AS (
+        SELECT ?3 WHERE ?3 < ?4
+        UNION ALL
+        SELECT ts + ?5 FROM slots WHERE ts + ?5 < ?4
+    )
+    SELECT
+        ?1 || '/' || ?2 || '/' || strftime('%Y/%m/%d/nfcapd.%Y%m%d%H%M', ts, 'unixepoch', 'localtime'),
+        ?2, ts, 0, CURRENT_TIMESTAMP
+    FROM slots
+    WHERE NOT EXISTS (
+        SELECT 1 FROM processed_files WHERE router = ?2 AND timestamp = slots.ts
+    )
+"""
+
+
+# Distinct on-grid timestamps a router already has in [?2, ?3) for step ?4; when
+# this equals the slot count, the router has no gaps to fill.
+COUNT_GRID_SLOTS_SQL = """
+    SELECT COUNT(DISTINCT timestamp) FROM processed_files
+    WHERE router = ?1 AND timestamp >= ?2 AND timestamp < ?3
+      AND (timestamp - ?2) % ?4 = 0
+"""
+
+
+def _sync_discovered_batch(conn: sqlite3.Connection, batch: list[tuple[str, str, int]]) -> int:
+    """
+    Upsert one batch of discovered files (no commit; the caller owns the transaction).
+    
+    New slots are inserted; existing slots whose path moved or that were gap
+    placeholders are updated to the discovered file, resetting their status
+    when they were gaps.
+    
+    Returns:
+        Number of newly inserted rows
+    """
+    cursor = conn.cursor()
+    changes_before = conn.total_changes
+    cursor.executemany(INSERT_MISSING_SLOT_SQL, batch)
+    new_files = conn.total_changes - changes_before
+    cursor.executemany("""
+        UPDATE processed_files
+        SET file_path = ?1,
+            file_exists = 1,
+            discovered_at = CASE
+                WHEN file_exists = 0 THEN CURRENT_TIMESTAMP
+                ELSE discovered_at
+            END,
+            processed_at = CASE
+                WHEN file_exists = 0 THEN NULL
+                ELSE processed_at
+            END,
+            flow_stats_status = CASE
+                WHEN file_exists = 0 THEN NULL
+                ELSE flow_stats_status
+            END,
+            ip_stats_status = CASE
+                WHEN file_exists = 0 THEN NULL
+                ELSE ip_stats_status
+            END,
+            protocol_stats_status = CASE
+                WHEN file_exists = 0 THEN NULL
+                ELSE protocol_stats_status
+            END,
+            spectrum_stats_status = CASE
+                WHEN file_exists = 0 THEN NULL
+                ELSE spectrum_stats_status
+            END,
+            structure_stats_status = CASE
+                WHEN file_exists = 0 THEN NULL
+                ELSE structure_stats_status
+            END
+        WHERE router = ?2 AND timestamp = ?3
+          AND (file_path != ?1 OR file_exists = 0)
+    """, batch)
+    return new_files
+
+
 def sync_processed_files_table(
     conn: sqlite3.Connection,
     include_gaps: bool = True,
@@ -204,7 +422,9 @@ def sync_processed_files_table(
             unlimited from ``DATA_START_DATE``.
         
     Returns:
-        Dictionary with counts: {'discovered': N, 'new_files': N, 'gaps': N}
+        Dictionary with counts: {'discovered': N, 'new_files': N, 'gaps': N}.
+        ``discovered`` counts files listed this run; day directories skipped
+        via scan_cache contribute nothing to it.
     """
     init_processed_files_table(conn)
     cursor = conn.cursor()
@@ -213,69 +433,81 @@ def sync_processed_files_table(
     
     # Phase 1: Insert all discovered files
     print("Scanning filesystem for NetFlow files...")
-    for file_path, router, timestamp in scan_filesystem(discovery_window_days):
-        stats['discovered'] += 1
-
-        timestamp_unix = timestamp_to_unix(timestamp)
-        existing = cursor.execute("""
-            SELECT file_path, file_exists
-            FROM processed_files
-            WHERE router = ? AND timestamp = ?
-            LIMIT 1
-        """, (router, timestamp_unix)).fetchone()
-
-        if existing is None:
-            cursor.execute("""
-                INSERT OR IGNORE INTO processed_files 
-                (file_path, router, timestamp, file_exists, discovered_at)
-                VALUES (?, ?, ?, 1, CURRENT_TIMESTAMP)
-            """, (file_path, router, timestamp_unix))
-            if cursor.rowcount > 0:
-                stats['new_files'] += 1
+    # Paths already recorded as present need no write on a re-scan; only new,
+    # moved, or previously-missing slots are sent to SQLite.
+    discovery_start_unix = timestamp_to_unix(get_discovery_start_dt(discovery_window_days))
+    known_paths = {
+        file_path for (file_path,) in cursor.execute("""
+            SELECT file_path FROM processed_files
+            WHERE file_exists = 1 AND timestamp >= ?
+        """, (discovery_start_unix,))
+    }
+    # Day directories unchanged since the last scan are not listed again. A
+    # cached mtime is only trusted while processed_files still holds a present
+    # row for every file the directory yielded last time, so deleted rows are
+    # rediscovered; the other entries (rows missing, or outside the discovery
+    # window) are pruned below.
+    known_dir_counts: Counter[str] = Counter(
+        file_path.rpartition('/')[0] for file_path in known_paths
+    )
+    dir_mtimes: dict[str, int] = {}
+    stale_dirs: list[tuple[str]] = []
+    for dir_path, mtime_ns, file_count in cursor.execute(
+        "SELECT dir_path, mtime_ns, file_count FROM scan_cache"
+    ):
+        if dir_path in known_dir_counts and known_dir_counts[dir_path] == file_count:
+            dir_mtimes[dir_path] = mtime_ns
         else:
-            existing_path, existing_file_exists = existing
-            if existing_path != file_path or existing_file_exists == 0:
-                cursor.execute("""
-                    UPDATE processed_files
-                    SET file_path = ?,
-                        file_exists = 1,
-                        discovered_at = CASE
-                            WHEN file_exists = 0 THEN CURRENT_TIMESTAMP
-                            ELSE discovered_at
-                        END,
-                        processed_at = CASE
-                            WHEN file_exists = 0 THEN NULL
-                            ELSE processed_at
-                        END,
-                        flow_stats_status = CASE
-                            WHEN file_exists = 0 THEN NULL
-                            ELSE flow_stats_status
-                        END,
-                        ip_stats_status = CASE
-                            WHEN file_exists = 0 THEN NULL
-                            ELSE ip_stats_status
-                        END,
-                        protocol_stats_status = CASE
-                            WHEN file_exists = 0 THEN NULL
-                            ELSE protocol_stats_status
-                        END,
-                        spectrum_stats_status = CASE
-                            WHEN file_exists = 0 THEN NULL
-                            ELSE spectrum_stats_status
-                        END,
-                        structure_stats_status = CASE
-                            WHEN file_exists = 0 THEN NULL
-                            ELSE structure_stats_status
-                        END
-                    WHERE router = ? AND timestamp = ?
-                """, (file_path, router, timestamp_unix))
+            stale_dirs.append((dir_path,))
+    scanned_dirs: dict[str, tuple[int, int]] = {}
+    
+    # Phase 1 is idempotent, so all of its writes share one transaction and
+    # one commit. BEGIN is deferred to the first write so a re-scan that finds
+    # nothing new never takes the write lock.
+    batch: list[tuple[str, str, int]] = []
+    try:
+        for file_path, router, timestamp_unix in scan_filesystem(
+            discovery_window_days, dir_mtimes, scanned_dirs
+        ):
+            stats['discovered'] += 1
+            if stats['discovered'] % SYNC_BATCH_SIZE == 0:
+                print(f"  Scanned {stats['discovered']} files...")
+            if file_path in known_paths:
+                continue
+            
+            batch.append((file_path, router, timestamp_unix))
+            if len(batch) >= SYNC_BATCH_SIZE:
+                if not conn.in_transaction:
+                    conn.execute("BEGIN IMMEDIATE")
+                stats['new_files'] += _sync_discovered_batch(conn, batch)
+                batch.clear()
         
-        # Commit periodically
-        if stats['discovered'] % 1000 == 0:
-            conn.commit()
-            print(f"  Scanned {stats['discovered']} files...")
+        if batch:
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            stats['new_files'] += _sync_discovered_batch(conn, batch)
+
+        # Cache entries are written with the rows they vouch for, so a failed
+        # sync never leaves a directory marked as scanned.
+        if stale_dirs:
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("DELETE FROM scan_cache WHERE dir_path = ?", stale_dirs)
+        if scanned_dirs:
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR REPLACE INTO scan_cache (dir_path, mtime_ns, file_count) VALUES (?, ?, ?)",
+                [
+                    (dir_path, mtime_ns, file_count)
+                    for dir_path, (mtime_ns, file_count) in scanned_dirs.items()
+                ],
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
     
-    conn.commit()
     print(f"Discovered {stats['discovered']} files, {stats['new_files']} new")
     
     if not include_gaps:
@@ -306,38 +538,50 @@ def sync_processed_files_table(
             print(f"  Router {router}: no gap scan needed within active window")
             continue
 
-        gaps = identify_gaps(conn, router, gap_start, data_horizon)
-        
-        for gap_timestamp in gaps:
-            # Construct the expected file path for this gap
-            gap_path = construct_file_path(router, gap_timestamp)
-            gap_timestamp_unix = timestamp_to_unix(gap_timestamp)
-
-            existing = cursor.execute("""
-                SELECT 1
-                FROM processed_files
-                WHERE router = ? AND timestamp = ?
-                LIMIT 1
-            """, (router, gap_timestamp_unix)).fetchone()
-
-            if existing is None:
-                cursor.execute("""
-                    INSERT OR IGNORE INTO processed_files 
-                    (file_path, router, timestamp, file_exists, discovered_at)
-                    VALUES (?, ?, ?, 0, CURRENT_TIMESTAMP)
-                """, (gap_path, router, gap_timestamp_unix))
-
-                if cursor.rowcount > 0:
-                    stats['gaps'] += 1
+        start_unix = timestamp_to_unix(gap_start)
+        end_unix = timestamp_to_unix(data_horizon)
+        step = GAP_INTERVAL_MINUTES * 60
+
+        # Steady-state runs find every slot already filled (by a file or an
+        # earlier placeholder); counting the index range is much cheaper than
+        # generating and probing each slot under the write lock.
+        expected_slots = (end_unix - start_unix + step - 1) // step
+        (present_slots,) = cursor.execute(
+            COUNT_GRID_SLOTS_SQL, (router, start_unix, end_unix, step)
+        ).fetchone()
+        if present_slots >= expected_slots:
+            print(f"  Router {router}: no gaps within active window")
+            continue
+
+        conn.execute("BEGIN IMMEDIATE")
+        changes_before = conn.total_changes
+        cursor.execute(INSERT_GAP_SLOTS_SQL, (
+            NETFLOW_DATA_PATH,
+            router,
+            start_unix,
+            end_unix,
+            step,
+        ))
+        router_gaps = conn.total_changes - changes_before
+        conn.commit()
+        stats['gaps'] += router_gaps
         
-        print(f"  Router {router}: {len(gaps)} gaps identified, {stats['gaps']} new gap entries")
+        print(f"  Router {router}: {router_gaps} new gap entries")
     
-    conn.commit()
     print(f"Total: {stats['gaps']} gap placeholders inserted")
     
     return stats
 
 
+def _pending_files_filter(reprocess_window_days: int) -> tuple[str, list[int]]:
+    """Return the WHERE clause and parameters selecting files not yet fully processed."""
+    cutoff_dt = get_reprocess_cutoff_dt(reprocess_window_days)
+    if cutoff_dt is None:
+        return "processed_at IS NULL", []
+    # Real files stay eligible regardless of age; only synthetic gaps are windowed.
+    return "processed_at IS NULL AND (file_exists = 1 OR timestamp >= ?)", [timestamp_to_unix(cutoff_dt)]
+
+
 def get_pending_files(
     conn: sqlite3.Connection,
     limit: int = None,
@@ -355,65 +599,47 @@ def get_pending_files(
         List of tuples: (file_path, router, timestamp, file_exists)
     """
     cursor = conn.cursor()
+    where, params = _pending_files_filter(reprocess_window_days)
 
-    cutoff_dt = get_reprocess_cutoff_dt(reprocess_window_days)
-    cutoff_unix = None if cutoff_dt is None else timestamp_to_unix(cutoff_dt)
-
-    query = """
+    # LIMIT is always bound (-1 means no limit) so the statement text stays cacheable
+    query = f"""
         SELECT file_path, router, timestamp, file_exists
         FROM processed_files
-        WHERE processed_at IS NULL
+        WHERE {where}
+        ORDER BY timestamp ASC LIMIT ?
     """
-    params: list[int] = []
-
-    if cutoff_unix is not None:
-        # Real files stay eligible regardless of age; only synthetic gaps are windowed.
-        query += " AND (file_exists = 1 OR timestamp >= ?)"
-        params.append(cutoff_unix)
-
-    query += " ORDER BY timestamp ASC"
+    params.append(limit or -1)
 
-    rows = cursor.execute(query, params).fetchall()
+    return [
+        (file_path, router, timestamp, bool(file_exists))
+        for file_path, router, timestamp, file_exists in cursor.execute(query, params)
+    ]
 
-    pending = []
-    for file_path, router, timestamp, file_exists in rows:
-        pending.append((file_path, router, timestamp, bool(file_exists)))
-        if limit and len(pending) >= limit:
-            break
 
-    return pending
+def count_pending_files(conn: sqlite3.Connection, reprocess_window_days: int = 30) -> int:
+    """
+    Count the files get_pending_files would return, without fetching them.
+    
+    Args:
+        conn: Database connection
+        reprocess_window_days: Processing window in days. ``0`` means unlimited.
+    """
+    where, params = _pending_files_filter(reprocess_window_days)
+    (count,) = conn.execute(f"SELECT COUNT(*) FROM processed_files WHERE {where}", params).fetchone()
+    return count
 
 
-def get_complete_days(conn: sqlite3.Connection) -> set[tuple[str, int]]:
+def get_status_column(table_name: str) -> str:
     """
-    Get the set of (router, day_start_timestamp) for days that are complete.
+    Return the processed_files status column for a processor table.
     
-    A day is complete if its end time (next midnight) is at or before the data horizon.
-    
-    Returns:
-        Set of (router, day_start_unix) tuples for complete days
+    Raises:
+        ValueError: If table_name is not a known processor table
     """
-    data_horizon = compute_data_horizon(conn)
-    cursor = conn.cursor()
-    
-    complete_days = set()
-    
-    # Get all distinct days from processed_files
-    rows = cursor.execute("""
-        SELECT DISTINCT router, timestamp FROM processed_files
-    """).fetchall()
-    
-    for router, timestamp in rows:
-        dt = unix_to_timestamp(timestamp)
-        day_start = dt.replace(hour=0, minute=0, second=0, microsecond=0)
-        day_end = day_start + timedelta(days=1)
-        
-        # Day is complete if data horizon is at or past the end of the day
-        if data_horizon >= day_end:
-            day_start_unix = timestamp_to_unix(day_start)
-            complete_days.add((router, day_start_unix))
-    
-    return complete_days
+    status_column = STATUS_COLUMNS.get(table_name)
+    if status_column is None:
+        raise ValueError(f"Invalid table name: {table_name}. Must be one of {list(PROCESSOR_TABLES)}")
+    return status_column
 
 
 def get_files_needing_processing(
@@ -437,11 +663,7 @@ def get_files_needing_processing(
     Returns:
         List of tuples: (file_path, router, timestamp, file_exists)
     """
-    valid_tables = ['flow_stats', 'ip_stats', 'protocol_stats', 'spectrum_stats', 'structure_stats']
-    if table_name not in valid_tables:
-        raise ValueError(f"Invalid table name: {table_name}. Must be one of {valid_tables}")
-    
-    status_column = f"{table_name}_status"
+    status_column = get_status_column(table_name)
     cursor = conn.cursor()
 
     cutoff_dt = get_reprocess_cutoff_dt(reprocess_window_days)
@@ -459,42 +681,26 @@ def get_files_needing_processing(
         query += " AND (file_exists = 1 OR timestamp >= ?)"
         params.append(cutoff_unix)
 
-    query += " ORDER BY timestamp ASC"
-
-    if not complete_days_only:
-        if limit:
-            query += " LIMIT ?"
-            params = [*params, limit]
-        rows = cursor.execute(query, params).fetchall()
-        return [(file_path, router, timestamp, bool(file_exists)) for file_path, router, timestamp, file_exists in rows]
-
-    # Filter to only complete days
-    complete_days = get_complete_days(conn)
-
-    batch_size = limit if limit else 1000
-    offset = 0
-    result = []
-
-    while True:
-        batch_query = f"{query} LIMIT ? OFFSET ?"
-        batch_params = [*params, batch_size, offset]
-        rows = cursor.execute(batch_query, batch_params).fetchall()
-        if not rows:
-            break
-
-        for file_path, router, timestamp, file_exists in rows:
-            dt = unix_to_timestamp(timestamp)
-            day_start = dt.replace(hour=0, minute=0, second=0, microsecond=0)
-            day_start_unix = timestamp_to_unix(day_start)
-
-            if (router, day_start_unix) in complete_days:
-                result.append((file_path, router, timestamp, bool(file_exists)))
-                if limit and len(result) >= limit:
-                    return result
+    if complete_days_only:
+        # A day is complete when its end (the next local midnight) is at or
+        # before the data horizon. That holds exactly for days that start
+        # before the horizon's own local midnight, so every row older than
+        # that midnight belongs to a complete day and the filter is a plain
+        # range bound on the timestamp-ordered scan.
+        horizon_day_start = timestamp_to_unix(
+            compute_data_horizon(conn).replace(hour=0, minute=0, second=0, microsecond=0)
+        )
+        query += " AND timestamp < ?"
+        params.append(horizon_day_start)
 
-        offset += len(rows)
+    # LIMIT is always bound (-1 means no limit) so the statement text stays cacheable
+    query += " ORDER BY timestamp ASC LIMIT ?"
+    params.append(limit or -1)
 
-    return result
+    return [
+        (file_path, router, timestamp, bool(file_exists))
+        for file_path, router, timestamp, file_exists in cursor.execute(query, params)
+    ]
 
 
 def group_files_by_day(
@@ -513,10 +719,14 @@ def group_files_by_day(
     
     days = defaultdict(list)
     
+    # Files arrive in timestamp order, so the current local day's bounds are
+    # kept and datetimes are only built when a file falls outside them.
+    day_start_unix = day_end_unix = 0
     for file_path, router, timestamp, file_exists in files:
-        dt = unix_to_timestamp(timestamp)
-        day_start = dt.replace(hour=0, minute=0, second=0, microsecond=0)
-        day_start_unix = timestamp_to_unix(day_start)
+        if not day_start_unix <= timestamp < day_end_unix:
+            day_start = unix_to_timestamp(timestamp).replace(hour=0, minute=0, second=0, microsecond=0)
+            day_start_unix = timestamp_to_unix(day_start)
+            day_end_unix = timestamp_to_unix(day_start + timedelta(days=1))
         
         days[(router, day_start_unix)].append((file_path, router, timestamp, file_exists))
     
@@ -543,50 +753,42 @@ def get_stale_days(
     Returns:
         Set of (router, day_start_unix) tuples for stale days
     """
-    valid_tables = ['flow_stats', 'ip_stats', 'protocol_stats', 'spectrum_stats', 'structure_stats']
-    if table_name not in valid_tables:
-        raise ValueError(f"Invalid table name: {table_name}. Must be one of {valid_tables}")
-    
-    status_column = f"{table_name}_status"
+    status_column = get_status_column(table_name)
     cursor = conn.cursor()
     
-    rows = cursor.execute(
-        f"""
-        SELECT router, timestamp, {status_column}
-        FROM processed_files
-        """
-    ).fetchall()
-
-    day_status: dict[tuple[str, int], dict[str, bool]] = {}
-    for router, timestamp, status in rows:
-        day_start_dt = unix_to_timestamp(timestamp).replace(
-            hour=0,
-            minute=0,
-            second=0,
-            microsecond=0,
+    # Pending rows are bucketed into local days in SQLite; each pending day then
+    # needs one (router, timestamp) range probe for a processed row, so fully
+    # processed history is never read. Once PRAGMA optimize (run when writer
+    # connections close) has analyzed processed_files, the planner reads the
+    # pending rows from the processor's partial index; no index is required.
+    rows = cursor.execute(f"""
+        WITH pending_days AS (
+            SELECT DISTINCT
+                router,
+                CAST(strftime('%s', timestamp, 'unixepoch', 'localtime', 'start of day', 'utc') AS INTEGER) AS day_start,
+                CAST(strftime('%s', timestamp, 'unixepoch', 'localtime', 'start of day', '+1 day', 'utc') AS INTEGER) AS day_end
+            FROM processed_files
+            WHERE {status_column} IS NULL
         )
-        day_start = timestamp_to_unix(day_start_dt)
-        state = day_status.setdefault(
-            (router, day_start),
-            {'has_processed': False, 'has_pending': False},
+        SELECT router, day_start FROM pending_days
+        WHERE EXISTS (
+            SELECT 1 FROM processed_files
+            WHERE router = pending_days.router
+              AND timestamp >= pending_days.day_start
+              AND timestamp < pending_days.day_end
+              AND {status_column} = 1
         )
-        if status == 1:
-            state['has_processed'] = True
-        if status is None:
-            state['has_pending'] = True
-
-    return {
-        key
-        for key, state in day_status.items()
-        if state['has_processed'] and state['has_pending']
-    }
+    """)
+
+    return set(rows)
 
 
 def reset_day_for_reprocessing(
     conn: sqlite3.Connection,
     table_name: str,
     router: str,
-    day_start: int
+    day_start: int,
+    commit: bool = True
 ) -> dict:
     """
     Reset a day for full reprocessing by clearing stats and resetting file status.
@@ -600,13 +802,12 @@ def reset_day_for_reprocessing(
         table_name: The stats table name (e.g., 'ip_stats')
         router: Router name
         day_start: Unix timestamp of day start (midnight)
+        commit: If False, leave the transaction to the caller
     
     Returns:
         Dict with counts: {'stats_deleted': N, 'files_reset': N}
     """
-    valid_tables = ['flow_stats', 'ip_stats', 'protocol_stats', 'spectrum_stats', 'structure_stats']
-    if table_name not in valid_tables:
-        raise ValueError(f"Invalid table name: {table_name}. Must be one of {valid_tables}")
+    status_column = get_status_column(table_name)
     
     # Map table_name to actual stats table
     stats_table_map = {
@@ -617,7 +818,6 @@ def reset_day_for_reprocessing(
         'structure_stats': 'structure_stats',
     }
     stats_table = stats_table_map[table_name]
-    status_column = f"{table_name}_status"
     
     day_end = day_start + 86400
     cursor = conn.cursor()
@@ -645,7 +845,8 @@ def reset_day_for_reprocessing(
     """, (router, day_start, day_end))
     stats['files_reset'] = cursor.rowcount
     
-    conn.commit()
+    if commit:
+        conn.commit()
     return stats
 
 
@@ -707,13 +908,22 @@ def handle_stale_days(
         print(f"[{table_name}] Skipping {stale_days_skipped_old} stale days older than cutoff "
               f"({cutoff_label})")
 
-    for router, day_start in stale_days_recent:
-        day_dt = unix_to_timestamp(day_start)
-        print(f"[{table_name}] Resetting {router} {day_dt.strftime('%Y-%m-%d')} for reprocessing")
-        
-        result = reset_day_for_reprocessing(conn, table_name, router, day_start)
-        summary['total_stats_deleted'] += result['stats_deleted']
-        summary['total_files_reset'] += result['files_reset']
+    # All resets share one transaction: one commit instead of one per day, and
+    # no half-reset set of days if a delete fails.
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    try:
+        for router, day_start in stale_days_recent:
+            day_dt = unix_to_timestamp(day_start)
+            print(f"[{table_name}] Resetting {router} {day_dt.strftime('%Y-%m-%d')} for reprocessing")
+            
+            result = reset_day_for_reprocessing(conn, table_name, router, day_start, commit=False)
+            summary['total_stats_deleted'] += result['stats_deleted']
+            summary['total_files_reset'] += result['files_reset']
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
     
     print(f"[{table_name}] Reset complete: {summary['total_stats_deleted']} stats deleted, "
           f"{summary['total_files_reset']} files reset")
@@ -728,7 +938,7 @@ def mark_file_processed(
     success: bool
 ) -> None:
     """
-    Mark a file as processed for a specific table.
+    Mark a file as processed for a specific table (no commit).
     
     Args:
         conn: Database connection
@@ -737,27 +947,7 @@ def mark_file_processed(
                     'spectrum_stats', 'structure_stats'
         success: True if processing succeeded, False if it failed
     """
-    valid_tables = ['flow_stats', 'ip_stats', 'protocol_stats', 'spectrum_stats', 'structure_stats']
-    if table_name not in valid_tables:
-        raise ValueError(f"Invalid table name: {table_name}. Must be one of {valid_tables}")
-    
-    status_column = f"{table_name}_status"
-    cursor = conn.cursor()
-    
-    cursor.execute(f"""
-        UPDATE processed_files
-        SET {status_column} = ?,
-            processed_at = CASE 
-                WHEN flow_stats_status IS NOT NULL 
-                     AND ip_stats_status IS NOT NULL 
-                     AND protocol_stats_status IS NOT NULL 
-                     AND spectrum_stats_status IS NOT NULL 
-                     AND structure_stats_status IS NOT NULL
-                THEN CURRENT_TIMESTAMP
-                ELSE processed_at
-            END
-        WHERE file_path = ?
-    """, (1 if success else 0, file_path))
+    mark_files_processed(conn, table_name, [(file_path, success)], commit=False)
 
 
 def update_processed_at(conn: sqlite3.Connection, file_path: str) -> None:
@@ -773,75 +963,87 @@ def update_processed_at(conn: sqlite3.Connection, file_path: str) -> None:
         UPDATE processed_files
         SET processed_at = CURRENT_TIMESTAMP
         WHERE file_path = ?
-          AND flow_stats_status IS NOT NULL 
-          AND ip_stats_status IS NOT NULL 
-          AND protocol_stats_status IS NOT NULL 
-          AND spectrum_stats_status IS NOT NULL 
-          AND structure_stats_status IS NOT NULL
+          AND all_done = 1
           AND processed_at IS NULL
     """, (file_path,))
 
 
-def batch_mark_processed(
+def mark_files_processed(
     conn: sqlite3.Connection,
     table_name: str,
-    results: list[dict],
+    file_statuses: list[tuple[str, bool]],
     commit: bool = True
 ) -> None:
     """
-    Batch update processed_files status for multiple files.
+    Set a table's status for many files with one executemany.
+    
+    Files whose five statuses are now all set get processed_at stamped.
+    With commit=True the updates run in their own transaction when none is
+    open; with commit=False the caller owns the transaction.
     
     Args:
         conn: Database connection
         table_name: One of 'flow_stats', 'ip_stats', 'protocol_stats', 
                     'spectrum_stats', 'structure_stats'
-        results: List of dicts with 'file_path' and 'success' keys
+        file_statuses: List of (file_path, success) pairs
         commit: If True (default), commits the transaction
     """
-    valid_tables = ['flow_stats', 'ip_stats', 'protocol_stats', 'spectrum_stats', 'structure_stats']
-    if table_name not in valid_tables:
-        raise ValueError(f"Invalid table name: {table_name}. Must be one of {valid_tables}")
+    get_status_column(table_name)  # raises ValueError for unknown tables
+    if commit and not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
     
-    status_column = f"{table_name}_status"
     cursor = conn.cursor()
-    
-    for result in results:
-        file_path = result['file_path']
-        success = result.get('success', False)
-        
-        cursor.execute(f"""
-            UPDATE processed_files
-            SET {status_column} = ?
-            WHERE file_path = ?
-        """, (1 if success else 0, file_path))
+    cursor.executemany(
+        _SET_STATUS_SQL[table_name],
+        [(1 if success else 0, file_path) for file_path, success in file_statuses],
+    )
     
     # Update processed_at for any files that are now fully processed
     cursor.execute("""
         UPDATE processed_files
         SET processed_at = CURRENT_TIMESTAMP
         WHERE processed_at IS NULL
-          AND flow_stats_status IS NOT NULL 
-          AND ip_stats_status IS NOT NULL 
-          AND protocol_stats_status IS NOT NULL 
-          AND spectrum_stats_status IS NOT NULL 
-          AND structure_stats_status IS NOT NULL
+          AND all_done = 1
     """)
     
     if commit:
         conn.commit()
 
 
+def batch_mark_processed(
+    conn: sqlite3.Connection,
+    table_name: str,
+    results: list[dict],
+    commit: bool = True
+) -> None:
+    """
+    Batch update processed_files status for multiple files.
+    
+    Args:
+        conn: Database connection
+        table_name: One of 'flow_stats', 'ip_stats', 'protocol_stats', 
+                    'spectrum_stats', 'structure_stats'
+        results: List of dicts with 'file_path' and 'success' keys
+        commit: If True (default), commits the transaction
+    """
+    mark_files_processed(
+        conn,
+        table_name,
+        [(result['file_path'], result.get('success', False)) for result in results],
+        commit=commit,
+    )
+
+
 if __name__ == "__main__":
     # Test the discovery module
-    import sqlite3
-    from common import DATABASE_PATH
+    from common import DATABASE_PATH, get_db_connection
     
     print(f"Testing discovery module...")
     print(f"NetFlow data path: {NETFLOW_DATA_PATH}")
     print(f"Available routers: {AVAILABLE_ROUTERS}")
     print(f"Database path: {DATABASE_PATH}")
     
-    with sqlite3.connect(DATABASE_PATH) as conn:
+    with get_db_connection() as conn:
         stats = sync_processed_files_table(conn)
         print(f"\nSync complete: {stats}")
         
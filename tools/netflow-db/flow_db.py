@@ -4,8 +4,10 @@ NetFlow basic statistics processor.
 Processes nfcapd files to extract flow, packet, and byte statistics.
 """
 
+import re
 import sqlite3
 import subprocess
+from contextlib import nullcontext
 from datetime import datetime
 from multiprocessing import Pool
 
@@ -18,6 +20,7 @@ from common import (
     get_db_connection,
     get_optional_env,
     timestamp_to_unix,
+    init_worker_process,
 )
 from discovery import (
     sync_processed_files_table,
@@ -28,6 +31,20 @@ from discovery import (
 
 FIRST_RUN = get_optional_env('FIRST_RUN', 'False').lower() in ('true', '1', 'yes')
 
+# nfdump -I keys in netflow_stats column order (first/last map to *_timestamp)
+STAT_KEYS = (
+    'flows', 'flows_tcp', 'flows_udp', 'flows_icmp', 'flows_other',
+    'packets', 'packets_tcp', 'packets_udp', 'packets_icmp', 'packets_other',
+    'bytes', 'bytes_tcp', 'bytes_udp', 'bytes_icmp', 'bytes_other',
+    'first', 'last', 'msec_first', 'msec_last', 'sequence_failures',
+)
+
+# "Key: value" lines; signed integers land in group 2, anything else in group 3.
+# \r is trimmed like other whitespace so CRLF output still parses as numbers.
+NFDUMP_STAT_LINE = re.compile(
+    r'^[ \t\r]*([^:\n]*?)[ \t\r]*:[ \t\r]*(?:([+-]?\d+)|(.*?))[ \t\r]*$', re.MULTILINE
+)
+
 
 def init_netflow_stats_table(conn: sqlite3.Connection) -> None:
     """Create the netflow_stats table if it doesn't exist."""
@@ -69,38 +86,33 @@ def init_netflow_stats_table(conn: sqlite3.Connection) -> None:
     )
     """)
 
-    cursor.execute("""
-    CREATE INDEX IF NOT EXISTS idx_router_timestamp ON netflow_stats (router, timestamp)
-    """)
+    # file_path lookups use the UNIQUE constraint's own index, and the unique
+    # (router, timestamp) index serves range scans; their plain duplicates only
+    # added a B-tree write per insert.
+    cursor.execute("DROP INDEX IF EXISTS idx_file_path")
 
     try:
         cursor.execute("""
         CREATE UNIQUE INDEX IF NOT EXISTS idx_netflow_router_timestamp_unique
         ON netflow_stats (router, timestamp)
         """)
+        cursor.execute("DROP INDEX IF EXISTS idx_router_timestamp")
     except sqlite3.IntegrityError:
         print("[flow_stats] Warning: netflow_stats has duplicate router/timestamp rows; "
               "skipping unique index creation until repaired")
-
-    cursor.execute("""
-    CREATE INDEX IF NOT EXISTS idx_file_path ON netflow_stats (file_path)
-    """)
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_router_timestamp ON netflow_stats (router, timestamp)
+        """)
     
     conn.commit()
 
 
 def parse_nfdump_output(output: str) -> dict:
     """Parse nfdump -I output and return a dictionary of values."""
-    data = {}
-    for line in output.split('\n'):
-        if ':' in line:
-            key, value = line.split(':', 1)
-            key = key.strip().lower()
-            try:
-                data[key] = int(value.strip())
-            except ValueError:
-                data[key] = value.strip()
-    return data
+    return {
+        key.lower(): int(number) if number else text
+        for key, number, text in NFDUMP_STAT_LINE.findall(output)
+    }
 
 
 def process_file_worker(task: tuple) -> dict:
@@ -127,12 +139,7 @@ def process_file_worker(task: tuple) -> dict:
     if not file_exists:
         # Gap placeholder - return zeros
         result['success'] = True
-        result['data'] = {
-            'flows': 0, 'flows_tcp': 0, 'flows_udp': 0, 'flows_icmp': 0, 'flows_other': 0,
-            'packets': 0, 'packets_tcp': 0, 'packets_udp': 0, 'packets_icmp': 0, 'packets_other': 0,
-            'bytes': 0, 'bytes_tcp': 0, 'bytes_udp': 0, 'bytes_icmp': 0, 'bytes_other': 0,
-            'first': 0, 'last': 0, 'msec_first': 0, 'msec_last': 0, 'sequence_failures': 0
-        }
+        result['data'] = dict.fromkeys(STAT_KEYS, 0)
         return result
     
     command = ["nfdump", "-I", "-r", file_path]
@@ -144,7 +151,6 @@ def process_file_worker(task: tuple) -> dict:
             data = parse_nfdump_output(proc_result.stdout)
             result['success'] = True
             result['data'] = data
-            print(f"[flow_stats] Processed {file_path}: {data.get('flows', 0)} flows")
         else:
             result['error'] = proc_result.stderr
             print(f"[flow_stats] Error processing {file_path}: {proc_result.stderr}")
@@ -161,65 +167,78 @@ def process_file_worker(task: tuple) -> dict:
 
 def batch_insert_results(conn: sqlite3.Connection, results: list[dict]) -> int:
     """
-    Batch insert processing results into the database.
+    Batch insert processing results into the database (no commit).
     
     Args:
         conn: Database connection
         results: List of result dicts from process_file_worker
         
     Returns:
-        Number of successfully inserted rows
+        Number of inserted rows
     """
-    cursor = conn.cursor()
-    inserted = 0
-    
+    rows = []
     for result in results:
         if not result['success'] or result['data'] is None:
             continue
         
         data = result['data']
-        try:
-            cursor.execute("""
-                DELETE FROM netflow_stats
-                WHERE router = ? AND timestamp = ? AND file_path != ?
-            """, (result['router'], result['timestamp'], result['file_path']))
-            cursor.execute("""
-                INSERT OR REPLACE INTO netflow_stats (
-                    file_path, router, timestamp,
-                    flows, flows_tcp, flows_udp, flows_icmp, flows_other,
-                    packets, packets_tcp, packets_udp, packets_icmp, packets_other,
-                    bytes, bytes_tcp, bytes_udp, bytes_icmp, bytes_other,
-                    first_timestamp, last_timestamp, msec_first, msec_last, sequence_failures
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                result['file_path'], result['router'], result['timestamp'],
-                data.get('flows', 0),
-                data.get('flows_tcp', 0),
-                data.get('flows_udp', 0),
-                data.get('flows_icmp', 0),
-                data.get('flows_other', 0),
-                data.get('packets', 0),
-                data.get('packets_tcp', 0),
-                data.get('packets_udp', 0),
-                data.get('packets_icmp', 0),
-                data.get('packets_other', 0),
-                data.get('bytes', 0),
-                data.get('bytes_tcp', 0),
-                data.get('bytes_udp', 0),
-                data.get('bytes_icmp', 0),
-                data.get('bytes_other', 0),
-                data.get('first', 0),
-                data.get('last', 0),
-                data.get('msec_first', 0),
-                data.get('msec_last', 0),
-                data.get('sequence_failures', 0)
-            ))
-            inserted += 1
-        except Exception as e:
-            print(f"[flow_stats] Error inserting {result['file_path']}: {e}")
+        rows.append((
+            result['file_path'], result['router'], result['timestamp'],
+            *[data.get(key, 0) for key in STAT_KEYS]
+        ))
     
-    conn.commit()
-    return inserted
+    if not rows:
+        return 0
+    
+    # One prepared statement per batch; the caller owns the transaction
+    cursor = conn.cursor()
+    cursor.executemany("""
+        DELETE FROM netflow_stats
+        WHERE router = ? AND timestamp = ? AND file_path != ?
+    """, [(row[1], row[2], row[0]) for row in rows])
+    cursor.executemany("""
+        INSERT OR REPLACE INTO netflow_stats (
+            file_path, router, timestamp,
+            flows, flows_tcp, flows_udp, flows_icmp, flows_other,
+            packets, packets_tcp, packets_udp, packets_icmp, packets_other,
+            bytes, bytes_tcp, bytes_udp, bytes_icmp, bytes_other,
+            first_timestamp, last_timestamp, msec_first, msec_last, sequence_failures
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, rows)
+    
+    return len(rows)
+
+
+def write_results_batch(
+    conn: sqlite3.Connection,
+    results: list[dict],
+    stats: dict,
+    batch_num: int,
+    total_batches: int
+) -> None:
+    """
+    Write one batch of worker results and update the running stats.
+    
+    Rows and processed_files status updates share one write transaction.
+    BEGIN IMMEDIATE takes the write lock up front so busy_timeout applies.
+    """
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        inserted = batch_insert_results(conn, results)
+        batch_mark_processed(conn, 'flow_stats', results, commit=False)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        stats['errors'] += len(results)
+        print(f"[flow_stats] Batch {batch_num}/{total_batches} transaction failed: {e}")
+        return
+    
+    batch_errors = len([r for r in results if not r['success']])
+    stats['processed'] += inserted
+    stats['errors'] += batch_errors
+    
+    print(f"[flow_stats] Batch {batch_num}/{total_batches} complete: "
+          f"{inserted} inserted, {batch_errors} errors")
 
 
 def process_pending_files(
@@ -258,30 +277,33 @@ def process_pending_files(
     stats['attempted'] = len(pending)
     print(f"[flow_stats] Processing {len(pending)} pending files with {MAX_WORKERS} workers...")
     
-    # Process in batches
-    for i in range(0, len(pending), BATCH_SIZE):
-        batch = pending[i:i + BATCH_SIZE]
-        batch_num = i // BATCH_SIZE + 1
-        total_batches = (len(pending) + BATCH_SIZE - 1) // BATCH_SIZE
-        
-        print(f"[flow_stats] Processing batch {batch_num}/{total_batches} ({len(batch)} files)")
-        
-        # Process batch in parallel
-        with Pool(processes=MAX_WORKERS) as pool:
-            results = pool.map(process_file_worker, batch)
-        
-        # Batch insert results
-        inserted = batch_insert_results(conn, results)
-        
-        # Batch update processed_files status
-        batch_mark_processed(conn, 'flow_stats', results)
-        
-        # Update stats
-        batch_errors = len([r for r in results if not r['success']])
-        stats['processed'] += inserted
-        stats['errors'] += batch_errors
-        
-        print(f"[flow_stats] Batch complete: {inserted} inserted, {batch_errors} errors")
+    total_batches = (len(pending) + BATCH_SIZE - 1) // BATCH_SIZE
+    batch: list[dict] = []
+    batch_num = 0
+    
+    # One worker pool for the whole run. Results stream back as workers finish,
+    # so nfdump keeps running in the workers while the parent writes a batch.
+    # A single worker runs inline; a one-process pool would only add IPC.
+    with (
+        Pool(processes=MAX_WORKERS, initializer=init_worker_process)
+        if MAX_WORKERS > 1 else nullcontext()
+    ) as pool:
+        results = (
+            pool.imap_unordered(process_file_worker, pending, chunksize=1)
+            if pool is not None
+            else map(process_file_worker, pending)
+        )
+        for result in results:
+            batch.append(result)
+            if len(batch) < BATCH_SIZE:
+                continue
+            batch_num += 1
+            write_results_batch(conn, batch, stats, batch_num, total_batches)
+            batch = []
+    
+    if batch:
+        batch_num += 1
+        write_results_batch(conn, batch, stats, batch_num, total_batches)
     
     return stats
 
@@ -7,7 +7,7 @@ Uses day-parallel processing with parent-thread DB writes.
 
 import sqlite3
 import subprocess
-import ipaddress
+from socket import AF_INET, AF_INET6, inet_pton
 from datetime import datetime, timedelta
 from multiprocessing import Pool
 from typing import Optional
@@ -21,9 +21,11 @@ from common import (
     BATCH_SIZE,
     get_db_connection,
     get_optional_env,
+    iter_nfdump_lines,
     construct_file_path,
     timestamp_to_unix,
     unix_to_timestamp,
+    init_worker_process,
 )
 from discovery import (
     sync_processed_files_table,
@@ -58,13 +60,14 @@ def init_ip_stats_table(conn: sqlite3.Connection) -> None:
 
 def process_file(file_info: tuple) -> dict:
     """
-    Process a single file and return results with IP address objects.
+    Process a single file and return results with packed IP addresses.
     
     Args:
         file_info: Tuple of (file_path, router, timestamp, file_exists)
         
     Returns:
-        Dict with file_path, success, data, and raw_ips (as ipaddress objects)
+        Dict with file_path, success, data, and raw_ips (as sets of packed
+        address bytes from inet_pton)
     """
     file_path, router, timestamp_unix, file_exists = file_info
     
@@ -84,42 +87,38 @@ def process_file(file_info: tuple) -> dict:
             'sa_ipv4_count': 0, 'da_ipv4_count': 0,
             'sa_ipv6_count': 0, 'da_ipv6_count': 0
         }
-        result['raw_ips'] = {'sa_v4': [], 'da_v4': [], 'sa_v6': [], 'da_v6': []}
+        result['raw_ips'] = {'sa_v4': set(), 'da_v4': set(), 'sa_v6': set(), 'da_v6': set()}
         return result
     
-    print(f"[ip_stats] Processing {file_path}")
+    # inet_pton parses and the bytes keys hash in C, keeping the per-record
+    # work out of pure-Python ipaddress objects.
+    sa_v4: set[bytes] = set()
+    da_v4: set[bytes] = set()
+    sa_v6: set[bytes] = set()
+    da_v6: set[bytes] = set()
     
-    sa_v4: set[ipaddress.IPv4Address] = set()
-    da_v4: set[ipaddress.IPv4Address] = set()
-    sa_v6: set[ipaddress.IPv6Address] = set()
-    da_v6: set[ipaddress.IPv6Address] = set()
-    
-    command = ["nfdump", "-r", file_path, "-q", "-o", "fmt:%sa,%da", "-n", "0", "ipv4"]
-    ipv6_command = ["nfdump", "-r", file_path, "-q", "-o", "fmt:%sa,%da", "-n", "0", "ipv6", "-6"]
+    # nfdump -A aggregates in C, so each pass emits every distinct address once
+    # instead of one line per flow; -6 keeps IPv6 addresses unabbreviated.
+    passes = (
+        ("srcip", "fmt:%sa", sa_v4, sa_v6),
+        ("dstip", "fmt:%da", da_v4, da_v6),
+    )
     
     try:
-        ipv4_result = subprocess.run(command, capture_output=True, text=True, timeout=300)
-        ipv6_result = subprocess.run(ipv6_command, capture_output=True, text=True, timeout=300)
-
-        if ipv4_result.returncode == 0:
-            for line in ipv4_result.stdout.strip().split("\n"):
-                if line.strip() and ',' in line:
-                    try:
-                        source_ip, dest_ip = line.strip().split(",")
-                        sa_v4.add(ipaddress.IPv4Address(source_ip.strip()))
-                        da_v4.add(ipaddress.IPv4Address(dest_ip.strip()))
-                    except (ValueError, ipaddress.AddressValueError):
-                        continue
-                        
-        if ipv6_result.returncode == 0:
-            for line in ipv6_result.stdout.strip().split("\n"):
-                if line.strip() and ',' in line:
-                    try:
-                        source_ip, dest_ip = line.strip().split(",")
-                        sa_v6.add(ipaddress.IPv6Address(source_ip.strip()))
-                        da_v6.add(ipaddress.IPv6Address(dest_ip.strip()))
-                    except (ValueError, ipaddress.AddressValueError):
-                        continue
+        for aggregation, output_format, v4_ips, v6_ips in passes:
+            command = ["-r", file_path, "-q", "-A", aggregation, "-o", output_format, "-6"]
+            for line in iter_nfdump_lines(command):
+                # nfdump right-aligns address columns
+                ip = line.strip()
+                if not ip:
+                    continue
+                try:
+                    if ':' in ip:
+                        v6_ips.add(inet_pton(AF_INET6, ip))
+                    else:
+                        v4_ips.add(inet_pton(AF_INET, ip))
+                except OSError:
+                    continue
         
         result['success'] = True
         result['data'] = {
@@ -128,17 +127,19 @@ def process_file(file_info: tuple) -> dict:
             'sa_ipv6_count': len(sa_v6),
             'da_ipv6_count': len(da_v6)
         }
-        # Store as lists of ipaddress objects (picklable)
         result['raw_ips'] = {
-            'sa_v4': list(sa_v4),
-            'da_v4': list(da_v4),
-            'sa_v6': list(sa_v6),
-            'da_v6': list(da_v6)
+            'sa_v4': sa_v4,
+            'da_v4': da_v4,
+            'sa_v6': sa_v6,
+            'da_v6': da_v6
         }
         
     except subprocess.TimeoutExpired:
         result['error'] = "Timeout"
         print(f"[ip_stats] Timeout processing {file_path}")
+    except subprocess.CalledProcessError as e:
+        result['error'] = e.stderr
+        print(f"[ip_stats] Error processing {file_path}: {e.stderr}")
     except Exception as e:
         result['error'] = str(e)
         print(f"[ip_stats] Error processing {file_path}: {e}")
@@ -146,42 +147,52 @@ def process_file(file_info: tuple) -> dict:
     return result
 
 
+IP_SET_KEYS = ('sa_v4', 'da_v4', 'sa_v6', 'da_v6')
+
+
+def _empty_ip_sets() -> dict[str, set[bytes]]:
+    return {key: set() for key in IP_SET_KEYS}
+
+
 def compute_aggregates(results: list[dict], router: str, day_start: int) -> list[dict]:
     """
     Compute 30m, 1h, and 1d aggregates from 5m results for a single day.
     """
     aggregates = []
     
-    buckets = {
-        '30m': defaultdict(lambda: {'sa_v4': set(), 'da_v4': set(), 'sa_v6': set(), 'da_v6': set()}),
-        '1h': defaultdict(lambda: {'sa_v4': set(), 'da_v4': set(), 'sa_v6': set(), 'da_v6': set()}),
-        '1d': defaultdict(lambda: {'sa_v4': set(), 'da_v4': set(), 'sa_v6': set(), 'da_v6': set()}),
-    }
+    # Only the 30m buckets take per-file sets; each coarser bucket is the union
+    # of the already-deduplicated buckets below it, so addresses repeated across
+    # files are hashed once per 30m bucket instead of once per file per level.
+    buckets_30m = defaultdict(_empty_ip_sets)
+    hour_of_30m: dict[int, int] = {}
     
     for result in results:
         if not result['success'] or result['raw_ips'] is None:
             continue
         
-        timestamp = result['timestamp']
         raw = result['raw_ips']
+        dt = unix_to_timestamp(result['timestamp'])
         
-        dt = unix_to_timestamp(timestamp)
+        bucket_30m_ts = timestamp_to_unix(dt.replace(minute=(dt.minute // 30) * 30, second=0, microsecond=0))
+        hour_of_30m[bucket_30m_ts] = timestamp_to_unix(dt.replace(minute=0, second=0, microsecond=0))
         
-        bucket_30m = dt.replace(minute=(dt.minute // 30) * 30, second=0, microsecond=0)
-        bucket_30m_ts = timestamp_to_unix(bucket_30m)
-        
-        bucket_1h = dt.replace(minute=0, second=0, microsecond=0)
-        bucket_1h_ts = timestamp_to_unix(bucket_1h)
-        
-        bucket_1d_ts = day_start
-        
-        for granularity, bucket_ts in [('30m', bucket_30m_ts), ('1h', bucket_1h_ts), ('1d', bucket_1d_ts)]:
-            bucket = buckets[granularity][bucket_ts]
-            bucket['sa_v4'].update(raw['sa_v4'])
-            bucket['da_v4'].update(raw['da_v4'])
-            bucket['sa_v6'].update(raw['sa_v6'])
-            bucket['da_v6'].update(raw['da_v6'])
+        bucket = buckets_30m[bucket_30m_ts]
+        for key in IP_SET_KEYS:
+            bucket[key].update(raw[key])
+    
+    buckets_1h = defaultdict(_empty_ip_sets)
+    for bucket_30m_ts, data in buckets_30m.items():
+        bucket = buckets_1h[hour_of_30m[bucket_30m_ts]]
+        for key in IP_SET_KEYS:
+            bucket[key].update(data[key])
     
+    buckets_1d = defaultdict(_empty_ip_sets)
+    for data in buckets_1h.values():
+        bucket = buckets_1d[day_start]
+        for key in IP_SET_KEYS:
+            bucket[key].update(data[key])
+    
+    buckets = {'30m': buckets_30m, '1h': buckets_1h, '1d': buckets_1d}
     durations = {'30m': 1800, '1h': 3600, '1d': 86400}
     
     for granularity in ['30m', '1h', '1d']:
@@ -202,39 +213,22 @@ def compute_aggregates(results: list[dict], router: str, day_start: int) -> list
 
 def insert_results(conn: sqlite3.Connection, rows_5m: list[dict], rows_agg: list[dict]) -> tuple[int, int]:
     """Insert prepared 5m and aggregate rows into the database (no commit)."""
+    # One prepared statement for the whole day; a failing row raises so the
+    # caller rolls back the day instead of committing it partially.
     cursor = conn.cursor()
-    inserted_5m = 0
-    inserted_agg = 0
-    
-    for row in rows_5m:
-        try:
-            cursor.execute("""
-                INSERT OR REPLACE INTO ip_stats 
-                (router, granularity, bucket_start, bucket_end, 
-                 sa_ipv4_count, da_ipv4_count, sa_ipv6_count, da_ipv6_count)
-                VALUES (?, '5m', ?, ?, ?, ?, ?, ?)
-            """, (row['router'], row['bucket_start'], row['bucket_end'],
-                  row['sa_ipv4_count'], row['da_ipv4_count'],
-                  row['sa_ipv6_count'], row['da_ipv6_count']))
-            inserted_5m += 1
-        except Exception as e:
-            print(f"[ip_stats] Error inserting 5m row {row['router']} {row['bucket_start']}: {e}")
-    
-    for agg in rows_agg:
-        try:
-            cursor.execute("""
-                INSERT OR REPLACE INTO ip_stats 
-                (router, granularity, bucket_start, bucket_end, 
-                 sa_ipv4_count, da_ipv4_count, sa_ipv6_count, da_ipv6_count)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (agg['router'], agg['granularity'], agg['bucket_start'], agg['bucket_end'],
-                  agg['sa_ipv4_count'], agg['da_ipv4_count'],
-                  agg['sa_ipv6_count'], agg['da_ipv6_count']))
-            inserted_agg += 1
-        except Exception as e:
-            print(f"[ip_stats] Error inserting aggregate: {e}")
+    cursor.executemany("""
+        INSERT OR REPLACE INTO ip_stats 
+        (router, granularity, bucket_start, bucket_end, 
+         sa_ipv4_count, da_ipv4_count, sa_ipv6_count, da_ipv6_count)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (row['router'], row['granularity'], row['bucket_start'], row['bucket_end'],
+         row['sa_ipv4_count'], row['da_ipv4_count'],
+         row['sa_ipv6_count'], row['da_ipv6_count'])
+        for row in (*rows_5m, *rows_agg)
+    ])
     
-    return inserted_5m, inserted_agg
+    return len(rows_5m), len(rows_agg)
 
 
 def process_day_worker(day_info: tuple) -> dict:
@@ -266,6 +260,7 @@ def process_day_worker(day_info: tuple) -> dict:
         bucket_start = result['timestamp']
         rows_5m.append({
             'router': result['router'],
+            'granularity': '5m',
             'bucket_start': bucket_start,
             'bucket_end': bucket_start + 300,
             'sa_ipv4_count': data['sa_ipv4_count'],
@@ -330,12 +325,12 @@ def process_pending_files(
                  for (router, day_start), files in sorted(days.items())]
     
     # Process days in parallel - parent thread owns all database writes
-    with Pool(processes=MAX_WORKERS) as pool:
+    with Pool(processes=MAX_WORKERS, initializer=init_worker_process) as pool:
         for result in pool.imap_unordered(process_day_worker, day_tasks, chunksize=1):
             day_dt = unix_to_timestamp(result['day']).strftime('%Y-%m-%d')
             print(f"[ip_stats] Parent writing {result['router']} {day_dt}")
             try:
-                conn.execute("BEGIN")
+                conn.execute("BEGIN IMMEDIATE")
                 inserted_5m, inserted_agg = insert_results(conn, result['rows_5m'], result['rows_agg'])
                 batch_mark_processed(conn, 'ip_stats', result['mark_results'], commit=False)
                 conn.commit()
@@ -182,7 +182,7 @@ def main():
         get_db_connection,
         init_processed_files_table,
     )
-    from discovery import compute_data_horizon, get_pending_files, sync_processed_files_table
+    from discovery import compute_data_horizon, count_pending_files, sync_processed_files_table
     import flow_db
     import ip_db
     import protocol_db
@@ -218,8 +218,8 @@ def main():
         horizon = compute_data_horizon(conn)
         print(f"\nData horizon: {horizon}")
 
-        pending = get_pending_files(conn, reprocess_window_days=reprocess_window_days)
-        print(f"Total pending files: {len(pending)}")
+        pending_count = count_pending_files(conn, reprocess_window_days=reprocess_window_days)
+        print(f"Total pending files: {pending_count}")
 
         return stats
 
@@ -23,6 +23,8 @@ from common import (
     construct_file_path,
     timestamp_to_unix,
     unix_to_timestamp,
+    init_worker_process,
+    iter_nfdump_lines,
 )
 from discovery import (
     sync_processed_files_table,
@@ -83,26 +85,19 @@ def process_file(file_info: tuple) -> dict:
         result['raw_protocols'] = {'ipv4': set(), 'ipv6': set()}
         return result
     
-    print(f"[protocol_stats] Processing {file_path}")
-    
     protocols_ipv4: set[str] = set()
     protocols_ipv6: set[str] = set()
     
-    command = ["nfdump", "-r", file_path, "-q", "-o", "fmt:%pr", "-A", "proto"]
+    args = ["-r", file_path, "-q", "-o", "fmt:%pr", "-A", "proto"]
     
     try:
-        ipv4_result = subprocess.run(command + ["ipv4", "-N"], capture_output=True, text=True, timeout=300)
-        ipv6_result = subprocess.run(command + ["ipv6", "-N"], capture_output=True, text=True, timeout=300)
-
-        if ipv4_result.returncode == 0:
-            for line in ipv4_result.stdout.strip().split("\n"):
-                if line.strip():
-                    protocols_ipv4.add(line.strip())
-                    
-        if ipv6_result.returncode == 0:
-            for line in ipv6_result.stdout.strip().split("\n"):
-                if line.strip():
-                    protocols_ipv6.add(line.strip())
+        # Stream nfdump stdout; a failed nfdump run raises rather than
+        # recording an empty protocol set for the file
+        for protocols, version in ((protocols_ipv4, "ipv4"), (protocols_ipv6, "ipv6")):
+            for line in iter_nfdump_lines(args + [version, "-N"]):
+                protocol = line.strip()
+                if protocol:
+                    protocols.add(protocol)
         
         result['success'] = True
         result['data'] = {
@@ -177,40 +172,20 @@ def compute_aggregates(results: list[dict], router: str, day_start: int) -> list
 def insert_results(conn: sqlite3.Connection, rows_5m: list[dict], rows_agg: list[dict]) -> tuple[int, int]:
     """Insert prepared 5m and aggregate rows into the database (no commit)."""
     cursor = conn.cursor()
-    inserted_5m = 0
-    inserted_agg = 0
-    
-    for row in rows_5m:
-        try:
-            cursor.execute("""
-                INSERT OR REPLACE INTO protocol_stats 
-                (router, granularity, bucket_start, bucket_end, 
-                 unique_protocols_count_ipv4, unique_protocols_count_ipv6,
-                 protocols_list_ipv4, protocols_list_ipv6)
-                VALUES (?, '5m', ?, ?, ?, ?, ?, ?)
-            """, (row['router'], row['bucket_start'], row['bucket_end'],
-                  row['unique_protocols_count_ipv4'], row['unique_protocols_count_ipv6'],
-                  row['protocols_list_ipv4'], row['protocols_list_ipv6']))
-            inserted_5m += 1
-        except Exception as e:
-            print(f"[protocol_stats] Error inserting 5m row {row['router']} {row['bucket_start']}: {e}")
-    
-    for agg in rows_agg:
-        try:
-            cursor.execute("""
-                INSERT OR REPLACE INTO protocol_stats 
-                (router, granularity, bucket_start, bucket_end, 
-                 unique_protocols_count_ipv4, unique_protocols_count_ipv6,
-                 protocols_list_ipv4, protocols_list_ipv6)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (agg['router'], agg['granularity'], agg['bucket_start'], agg['bucket_end'],
-                  agg['unique_protocols_count_ipv4'], agg['unique_protocols_count_ipv6'],
-                  agg['protocols_list_ipv4'], agg['protocols_list_ipv6']))
-            inserted_agg += 1
-        except Exception as e:
-            print(f"[protocol_stats] Error inserting aggregate: {e}")
+    cursor.executemany("""
+        INSERT OR REPLACE INTO protocol_stats 
+        (router, granularity, bucket_start, bucket_end, 
+         unique_protocols_count_ipv4, unique_protocols_count_ipv6,
+         protocols_list_ipv4, protocols_list_ipv6)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (row['router'], row['granularity'], row['bucket_start'], row['bucket_end'],
+         row['unique_protocols_count_ipv4'], row['unique_protocols_count_ipv6'],
+         row['protocols_list_ipv4'], row['protocols_list_ipv6'])
+        for row in (*rows_5m, *rows_agg)
+    ])
     
-    return inserted_5m, inserted_agg
+    return len(rows_5m), len(rows_agg)
 
 
 def process_day_worker(day_info: tuple) -> dict:
@@ -242,6 +217,7 @@ def process_day_worker(day_info: tuple) -> dict:
         bucket_start = result['timestamp']
         rows_5m.append({
             'router': result['router'],
+            'granularity': '5m',
             'bucket_start': bucket_start,
             'bucket_end': bucket_start + 300,
             'unique_protocols_count_ipv4': len(data['protocols_ipv4']),
@@ -319,12 +295,12 @@ def process_pending_files(
                  for (router, day_start), files in sorted(days.items())]
     
     # Process days in parallel - parent thread owns all database writes
-    with Pool(processes=MAX_WORKERS) as pool:
+    with Pool(processes=MAX_WORKERS, initializer=init_worker_process) as pool:
         for result in pool.imap_unordered(process_day_worker, day_tasks, chunksize=1):
             day_dt = unix_to_timestamp(result['day']).strftime('%Y-%m-%d')
             print(f"[protocol_stats] Parent writing {result['router']} {day_dt}")
             try:
-                conn.execute("BEGIN")
+                conn.execute("BEGIN IMMEDIATE")
                 inserted_5m, inserted_agg = insert_results(conn, result['rows_5m'], result['rows_agg'])
                 batch_mark_processed(conn, 'protocol_stats', result['mark_results'], commit=False)
                 conn.commit()
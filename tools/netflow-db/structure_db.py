@@ -7,11 +7,11 @@ Uses day-parallel processing with parent-thread DB writes.
 
 import sqlite3
 import subprocess
-import ipaddress
 import json
 from datetime import datetime, timedelta
 from multiprocessing import Pool
 from pathlib import Path
+from socket import AF_INET, inet_ntop, inet_pton
 from collections import defaultdict
 
 from common import (
@@ -23,9 +23,11 @@ from common import (
     BATCH_SIZE,
     get_db_connection,
     get_optional_env,
+    iter_nfdump_lines,
     construct_file_path,
     timestamp_to_unix,
     unix_to_timestamp,
+    init_worker_process,
 )
 from discovery import (
     sync_processed_files_table,
@@ -66,38 +68,37 @@ def init_structure_stats_table(conn: sqlite3.Connection) -> None:
     conn.commit()
 
 
-def extract_ips(file_path: str) -> tuple[set[ipaddress.IPv4Address], set[ipaddress.IPv4Address]]:
-    """Extract unique source and destination IPv4 addresses from a netflow file."""
-    source_ips: set[ipaddress.IPv4Address] = set()
-    dest_ips: set[ipaddress.IPv4Address] = set()
+def extract_ips(file_path: str) -> tuple[set[bytes], set[bytes]]:
+    """
+    Extract unique source and destination IPv4 addresses from a netflow file.
     
-    try:
-        result = subprocess.run(
-            ["nfdump", "-r", file_path, "-q", "-o", "fmt:%sa,%da", "ipv4"],
-            capture_output=True, text=True, timeout=300
-        )
-        if result.returncode == 0:
-            for line in result.stdout.strip().split("\n"):
-                if line.strip() and "," in line:
-                    parts = line.split(",")
-                    if len(parts) >= 2:
-                        try:
-                            source_ips.add(ipaddress.IPv4Address(parts[0].strip()))
-                        except ipaddress.AddressValueError:
-                            pass
-                        try:
-                            dest_ips.add(ipaddress.IPv4Address(parts[1].strip()))
-                        except ipaddress.AddressValueError:
-                            pass
-    except subprocess.TimeoutExpired:
-        print(f"Timeout extracting IPs from {file_path}")
-    except Exception as e:
-        print(f"Error extracting IPs from {file_path}: {e}")
+    Raises:
+        subprocess.TimeoutExpired: If nfdump did not finish in time
+        subprocess.CalledProcessError: If nfdump failed, so partial sets are
+            never returned
+    """
+    source_ips: set[bytes] = set()
+    dest_ips: set[bytes] = set()
+    
+    # Stream nfdump stdout instead of buffering and splitting the whole dump
+    for line in iter_nfdump_lines(["-r", file_path, "-q", "-o", "fmt:%sa,%da", "ipv4"]):
+        source_ip, separator, dest_ip = line.partition(",")
+        if not separator:
+            continue
+        # Packed 4-byte keys parse and hash in C without per-address objects
+        try:
+            source_ips.add(inet_pton(AF_INET, source_ip.strip()))
+        except OSError:
+            pass
+        try:
+            dest_ips.add(inet_pton(AF_INET, dest_ip.strip()))
+        except OSError:
+            pass
     
     return source_ips, dest_ips
 
 
-def compute_structure_function(ips: set[ipaddress.IPv4Address]) -> list[dict]:
+def compute_structure_function(ips: set[bytes]) -> list[dict]:
     """Compute structure function using Zig StructureFunction binary via stdin.
     
     Returns:
@@ -106,8 +107,8 @@ def compute_structure_function(ips: set[ipaddress.IPv4Address]) -> list[dict]:
     if not ips or len(ips) < MIN_IPS_FOR_STRUCTURE:
         return []
     
-    # Convert ipaddress objects to strings for stdin
-    input_data = '\n'.join(str(ip) for ip in ips)
+    # Convert packed addresses back to dotted quads for stdin
+    input_data = '\n'.join(inet_ntop(AF_INET, ip) for ip in ips)
     
     try:
         result = subprocess.run(
@@ -164,7 +165,7 @@ def process_file(file_info: tuple) -> dict:
         file_info: Tuple of (file_path, router, timestamp, file_exists)
         
     Returns:
-        Dict with file_path, success, data, and raw_ips_sa/raw_ips_da (as ipaddress objects)
+        Dict with file_path, success, data, and raw_ips_sa/raw_ips_da (as packed IPv4 bytes)
     """
     file_path, router, timestamp_unix, file_exists = file_info
     
@@ -186,8 +187,6 @@ def process_file(file_info: tuple) -> dict:
         result['raw_ips_da'] = set()
         return result
     
-    print(f"[structure_stats] Processing {file_path}")
-    
     try:
         source_ips, dest_ips = extract_ips(file_path)
         structure_sa = compute_structure_function(source_ips)
@@ -198,6 +197,9 @@ def process_file(file_info: tuple) -> dict:
         result['raw_ips_sa'] = source_ips
         result['raw_ips_da'] = dest_ips
         
+    except subprocess.TimeoutExpired:
+        result['error'] = "Timeout"
+        print(f"[structure_stats] Timeout processing {file_path}")
     except Exception as e:
         result['error'] = str(e)
         print(f"[structure_stats] Error processing {file_path}: {e}")
@@ -213,12 +215,12 @@ def compute_aggregates(results: list[dict], router: str, day_start: int) -> list
     aggregates = []
     
     # Separate buckets for source and destination IPs
-    buckets_sa: dict[str, dict[int, set[ipaddress.IPv4Address]]] = {
+    buckets_sa: dict[str, dict[int, set[bytes]]] = {
         '30m': defaultdict(set),
         '1h': defaultdict(set),
         '1d': defaultdict(set),
     }
-    buckets_da: dict[str, dict[int, set[ipaddress.IPv4Address]]] = {
+    buckets_da: dict[str, dict[int, set[bytes]]] = {
         '30m': defaultdict(set),
         '1h': defaultdict(set),
         '1d': defaultdict(set),
@@ -269,34 +271,17 @@ def compute_aggregates(results: list[dict], router: str, day_start: int) -> list
 def insert_results(conn: sqlite3.Connection, rows_5m: list[dict], rows_agg: list[dict]) -> tuple[int, int]:
     """Insert prepared 5m and aggregate rows into the database (no commit)."""
     cursor = conn.cursor()
-    inserted_5m = 0
-    inserted_agg = 0
-    
-    for row in rows_5m:
-        try:
-            cursor.execute("""
-                INSERT OR REPLACE INTO structure_stats 
-                (router, granularity, bucket_start, bucket_end, ip_version, structure_json_sa, structure_json_da)
-                VALUES (?, '5m', ?, ?, 4, ?, ?)
-            """, (row['router'], row['bucket_start'], row['bucket_end'],
-                  row['structure_json_sa'], row['structure_json_da']))
-            inserted_5m += 1
-        except Exception as e:
-            print(f"[structure_stats] Error inserting 5m row {row['router']} {row['bucket_start']}: {e}")
-    
-    for agg in rows_agg:
-        try:
-            cursor.execute("""
-                INSERT OR REPLACE INTO structure_stats 
-                (router, granularity, bucket_start, bucket_end, ip_version, structure_json_sa, structure_json_da)
-                VALUES (?, ?, ?, ?, 4, ?, ?)
-            """, (agg['router'], agg['granularity'], agg['bucket_start'], agg['bucket_end'],
-                  agg['structure_json_sa'], agg['structure_json_da']))
-            inserted_agg += 1
-        except Exception as e:
-            print(f"[structure_stats] Error inserting aggregate: {e}")
-    
-    return inserted_5m, inserted_agg
+    cursor.executemany("""
+        INSERT OR REPLACE INTO structure_stats 
+        (router, granularity, bucket_start, bucket_end, ip_version, structure_json_sa, structure_json_da)
+        VALUES (?, ?, ?, ?, 4, ?, ?)
+    """, [
+        (row['router'], row['granularity'], row['bucket_start'], row['bucket_end'],
+         row['structure_json_sa'], row['structure_json_da'])
+        for row in (*rows_5m, *rows_agg)
+    ])
+    
+    return len(rows_5m), len(rows_agg)
 
 
 def process_day_worker(day_info: tuple) -> dict:
@@ -328,6 +313,7 @@ def process_day_worker(day_info: tuple) -> dict:
         data = result['data']
         rows_5m.append({
             'router': result['router'],
+            'granularity': '5m',
             'bucket_start': bucket_start,
             'bucket_end': bucket_start + 300,
             'structure_json_sa': json.dumps(data['structure_sa']),
@@ -401,12 +387,12 @@ def process_pending_files(
                  for (router, day_start), files in sorted(days.items())]
     
     # Process days in parallel - parent thread owns all database writes
-    with Pool(processes=MAX_WORKERS) as pool:
+    with Pool(processes=MAX_WORKERS, initializer=init_worker_process) as pool:
         for result in pool.imap_unordered(process_day_worker, day_tasks, chunksize=1):
             day_dt = unix_to_timestamp(result['day']).strftime('%Y-%m-%d')
             print(f"[structure_stats] Parent writing {result['router']} {day_dt}")
             try:
-                conn.execute("BEGIN")
+                conn.execute("BEGIN IMMEDIATE")
                 inserted_5m, inserted_agg = insert_results(conn, result['rows_5m'], result['rows_agg'])
                 batch_mark_processed(conn, 'structure_stats', result['mark_results'], commit=False)
                 conn.commit()